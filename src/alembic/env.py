@@ -10,6 +10,7 @@ import app.db.models
 from alembic import context
 
 from app.db.session import Base
+from app.db.archive import is_archive_table
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
@@ -22,6 +23,12 @@ fileConfig(config.config_file_name)
 # base model metadata
 target_metadata = Base.metadata
 
+
+def include_name(name, type_, parent_names):
+    # archive tables are managed by app/scripts/archive_deleted.py, not by migrations
+    return not (type_ == "table" and is_archive_table(name))
+
+
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
 # my_important_option = config.get_main_option("my_important_option")
@@ -48,6 +55,7 @@ def run_migrations_offline():
         target_metadata=target_metadata,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
+        include_name=include_name,
     )
 
     with context.begin_transaction():
@@ -68,7 +76,7 @@ def run_migrations_online():
     )
 
     with connectable.connect() as connection:
-        context.configure(connection=connection, target_metadata=target_metadata)
+        context.configure(connection=connection, target_metadata=target_metadata, include_name=include_name)
 
         with context.begin_transaction():
             context.run_migrations()
@@ -0,0 +1,34 @@
+"""standard indexes
+
+Revision ID: 01c5449eb102
+Revises: 282e44c4eb7e
+Create Date: 2026-10-18 19:58:56.408035
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '01c5449eb102'
+down_revision = '282e44c4eb7e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # built concurrently so large tables stay writable, which has to happen outside a transaction
+    with op.get_context().autocommit_block():
+        op.create_index('ix_user_modified', 'user', ['modified'], unique=False, postgresql_concurrently=True)
+        op.create_index('ix_user_owner_live', 'user', ['created_by_id', sa.literal_column('id DESC')], unique=False, postgresql_where=sa.text('NOT is_deleted'), postgresql_concurrently=True)
+        op.create_index('ux_user_external_id_live', 'user', ['external_id'], unique=True, postgresql_where=sa.text('NOT is_deleted'), postgresql_concurrently=True)
+        # replaced by ux_user_external_id_live, every external id lookup filters out deleted rows
+        op.drop_index('ix_user_external_id', table_name='user', postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.create_index('ix_user_external_id', 'user', ['external_id'], unique=False, postgresql_concurrently=True)
+        op.drop_index('ux_user_external_id_live', table_name='user', postgresql_concurrently=True)
+        op.drop_index('ix_user_owner_live', table_name='user', postgresql_concurrently=True)
+        op.drop_index('ix_user_modified', table_name='user', postgresql_concurrently=True)
@@ -0,0 +1,29 @@
+"""table version
+
+Revision ID: 5d2e8a1c7b90
+Revises: 01c5449eb102
+Create Date: 2026-10-18 21:12:40.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d2e8a1c7b90'
+down_revision = '01c5449eb102'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # bumped by archive_deleted, list etags include it
+    op.create_table('table_version',
+    sa.Column('table_name', sa.String(length=255), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('table_name')
+    )
+
+
+def downgrade():
+    op.drop_table('table_version')
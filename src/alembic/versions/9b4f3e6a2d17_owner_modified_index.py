@@ -0,0 +1,27 @@
+"""owner modified index
+
+Revision ID: 9b4f3e6a2d17
+Revises: 5d2e8a1c7b90
+Create Date: 2026-10-18 21:40:03.552917
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9b4f3e6a2d17'
+down_revision = '5d2e8a1c7b90'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # built concurrently so large tables stay writable, which has to happen outside a transaction
+    with op.get_context().autocommit_block():
+        op.create_index('ix_user_owner_modified', 'user', ['created_by_id', 'modified'], unique=False, postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_user_owner_modified', table_name='user', postgresql_concurrently=True)
@@ -2,15 +2,30 @@ from fastapi import Depends, HTTPException, Request, status
 from fastapi.openapi.models import OAuthFlows as OAuthFlowsModel
 from fastapi.security import OAuth2, SecurityScopes
 from fastapi.security.utils import get_authorization_scheme_param
-from app.config import AUTH_COOKIE_ID, AUTH_SCOPES
+from app.config import (
+    AUTH_COOKIE_ID,
+    AUTH_SCOPES,
+    USER_CACHE_SIZE,
+    USER_CACHE_TTL,
+    PASSWORD_HASH_EXECUTOR,
+    PASSWORD_HASH_WORKERS,
+    PASSWORD_HASH_MAX_PENDING,
+)
 from typing import Dict, Optional
 
 import jwt
 from passlib.context import CryptContext
 
+from app.api.lib.cache import TTLCache
+from app.api.lib.executors import BoundedExecutor
+from app.api.lib.metrics import timed
 from app.api.schemas import TokenData
+from app.api.utils import get_db
+from app.db.async_crud import save_resource
+from app.db.crud import on_write
 from app.db.models import User
-from app.db.session import SessionManager
+from app.db.session import RequestSession
+from sqlalchemy import inspect, select
 from datetime import datetime, timedelta
 from app.config import APP_SECRET
 import logging
@@ -21,6 +36,38 @@ logger = logging.getLogger("authentication")
 ALGORITHM = "HS256"
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+password_executor = BoundedExecutor(
+    kind=PASSWORD_HASH_EXECUTOR,
+    max_workers=PASSWORD_HASH_WORKERS,
+    max_pending=PASSWORD_HASH_MAX_PENDING,
+)
+
+# users resolved from a token, keyed by the token subject (email)
+user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
+
+class CachedUser:
+    """
+    A copy of a user's column values. Cached users outlive the session that loaded them, a session bound
+    User would be expired by a rollback in that request & detached once the session closes
+    """
+
+    def __init__(self, user: User):
+        for attr in inspect(User).column_attrs:
+            setattr(self, attr.key, getattr(user, attr.key))
+
+
+@on_write
+def invalidate_cached_users(model, records):
+    if model is not User:
+        return
+    # only this process's cache, other workers catch up within USER_CACHE_TTL
+    # bulk writes pass plain mappings instead of User objects
+    records = [r if isinstance(r, dict) else vars(r) for r in records]
+    ids = {r.get("id") for r in records}
+    # match on id as well in case the email was changed
+    emails = {r["email"].lower() for r in records if r.get("email")}
+    user_cache.evict(lambda email, user: email in emails or user.id in ids)
 
 
 class OAuth2PasswordBearerWithCookie(OAuth2):
@@ -67,24 +114,42 @@ def get_password_hash(password):
     return pwd_context.hash(password)
 
 
-def get_user(email: str):
-    with SessionManager() as db:
-        user = (
-            db.query(User)
-            .filter(User.email == email.lower())
-            .filter(User.is_deleted == False)
-            .first()
-        )
-        if user:
-            return user
+def check_password(plain_password, hashed_password):
+    """
+    Verifies the password & returns a new hash when the stored one was made with outdated settings
+    """
+    if not verify_password(plain_password, hashed_password):
+        return False, None
+    # hashes from schemes passlib doesn't know can't be upgraded
+    if pwd_context.identify(hashed_password, required=False) and pwd_context.needs_update(hashed_password):
+        return True, get_password_hash(plain_password)
+    return True, None
+
 
+async def hash_password(password):
+    return await password_executor.run(get_password_hash, password)
 
-def authenticate_user(email: str, password: str):
-    user = get_user(email)
+
+def user_query(email: str):
+    return select(User).filter(User.email == email.lower()).filter(User.is_deleted == False)
+
+
+async def get_user(session: RequestSession, email: str):
+    db = await session.get(model=User)
+    result = await db.execute(user_query(email))
+    return result.scalars().first()
+
+
+async def authenticate_user(session: RequestSession, email: str, password: str):
+    user = await get_user(session, email)
     if not user:
         return False
-    if not verify_password(password, user.password):
+    valid, new_hash = await password_executor.run(check_password, password, user.password)
+    if not valid:
         return False
+    if new_hash:
+        user.password = new_hash
+        user = await save_resource(await session.get(), user, user.id)
     return user
 
 
@@ -104,8 +169,15 @@ def get_token_data(token: str):
 
 
 async def get_current_user(
-    security_scopes: SecurityScopes, token: str = Depends(oauth2_scheme)
+    security_scopes: SecurityScopes,
+    token: str = Depends(oauth2_scheme),
+    session: RequestSession = Depends(get_db),
 ):
+    with timed("auth"):
+        return await authenticate_token(security_scopes, token, session)
+
+
+async def authenticate_token(security_scopes: SecurityScopes, token: str, session: RequestSession):
     authentication_value = "Bearer"
     if security_scopes.scopes:
         authentication_value += ' scope="{scopes.scopes_str}"'
@@ -126,9 +198,13 @@ async def get_current_user(
     except Exception:
         print(traceback.format_exc())
         raise credentials_exception
-    user = get_user(email=token_data.username)
+    user = user_cache.get(token_data.username.lower())
     if user is None:
-        raise credentials_exception
+        user = await get_user(session, email=token_data.username)
+        if user is None:
+            raise credentials_exception
+        user = CachedUser(user)
+        user_cache.set(token_data.username.lower(), user)
     for scope in security_scopes.scopes:
         if scope not in token_data.scopes:
             raise HTTPException(
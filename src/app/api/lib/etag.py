@@ -0,0 +1,33 @@
+import hashlib
+from typing import Optional
+
+
+def weak_etag(*parts) -> str:
+    digest = hashlib.blake2b("|".join(str(p) for p in parts).encode(), digest_size=16).hexdigest()
+    return f'W/"{digest}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Weak comparison of an If-None-Match header against an etag
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque for tag in if_none_match.split(","))
+
+
+def record_etag(record, *params) -> str:
+    return weak_etag(record.id, record.modified.isoformat(), *params)
+
+
+def list_etag(last_modified, archived, query_params, scope) -> str:
+    """
+    Every write bumps `modified`, soft deletes included, so the latest `modified` across all the records
+    the caller can see changes whenever any page they could request changes. Archiving tombstones can lower
+    it back to an earlier value, the archived version tells those apart
+    """
+    params = "&".join(f"{k}={v}" for k, v in sorted(query_params.multi_items()))
+    return weak_etag(last_modified.isoformat() if last_modified else None, archived, params, scope)
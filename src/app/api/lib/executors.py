@@ -0,0 +1,43 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from app.exceptions import Codes
+
+
+class BoundedExecutor:
+    """
+    Runs blocking, cpu heavy functions off the event loop in a thread or process pool.
+    Once `max_pending` calls are queued or running, new calls are rejected with a 503
+    instead of queueing up behind them
+    """
+
+    def __init__(self, kind: str = "thread", max_workers: int = None, max_pending: int = 64):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Unknown executor kind {kind}")
+        self.kind = kind
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self._executor = None
+
+    @property
+    def executor(self):
+        # created on first use so importing the app doesn't start workers
+        if self._executor is None:
+            pool = ThreadPoolExecutor if self.kind == "thread" else ProcessPoolExecutor
+            self._executor = pool(max_workers=self.max_workers)
+        return self._executor
+
+    async def run(self, fn, *args):
+        if self.pending >= self.max_pending:
+            raise Codes.SERVER_BUSY
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, fn, *args)
+        finally:
+            self.pending -= 1
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
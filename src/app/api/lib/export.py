@@ -0,0 +1,75 @@
+"""
+Encoders that turn batches of rows into streamed NDJSON, CSV or Arrow IPC bytes.
+Arrow needs the optional `pyarrow` package
+"""
+import csv
+import io
+from datetime import datetime
+
+import orjson
+from sqlalchemy import Boolean, DateTime, Float, Integer, String
+
+try:
+    import pyarrow as pa
+except ImportError:  # pragma: no cover - optional dependency
+    pa = None
+
+
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+# end of stream marker for the arrow ipc stream format
+ARROW_EOS = b"\xff\xff\xff\xff\x00\x00\x00\x00"
+
+
+async def ndjson_chunks(columns, partitions):
+    async for rows in partitions:
+        yield b"".join(orjson.dumps(dict(zip(columns, row))) + b"\n" for row in rows)
+
+
+async def csv_chunks(columns, partitions):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    async for rows in partitions:
+        writer.writerows(rows)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def arrow_type(column):
+    if isinstance(column.type, Boolean):
+        return pa.bool_()
+    if isinstance(column.type, Integer):
+        return pa.int64()
+    if isinstance(column.type, Float):
+        return pa.float64()
+    if isinstance(column.type, DateTime):
+        return pa.timestamp("us")
+    if isinstance(column.type, String):
+        return pa.string()
+    return pa.string()
+
+
+def _arrow_value(value, type_):
+    if value is None or not pa.types.is_string(type_) or isinstance(value, str):
+        return value
+    return value.isoformat() if isinstance(value, datetime) else str(value)
+
+
+async def arrow_chunks(columns, partitions, sql_columns):
+    schema = pa.schema([(name, arrow_type(c)) for name, c in zip(columns, sql_columns)])
+    yield schema.serialize().to_pybytes()
+    async for rows in partitions:
+        arrays = [
+            pa.array([_arrow_value(row[i], field.type) for row in rows], type=field.type)
+            for i, field in enumerate(schema)
+        ]
+        yield pa.RecordBatch.from_arrays(arrays, schema=schema).serialize().to_pybytes()
+    yield ARROW_EOS
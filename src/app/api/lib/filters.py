@@ -0,0 +1,313 @@
+"""
+A small filter language for the `q` param, compiled to sqlalchemy expressions with bound parameters.
+
+    email = 'a@b.com' and (first_name startswith 'Jo' or id in (1, 2, 3))
+    created between '2023-01-01' and '2023-02-01' and not is_disabled = true
+    last_login is not null
+
+Comparisons are `field op value` where op is one of = != < <= > >= (or eq ne lt le gt ge),
+`in (values)`, `between value and value`, `startswith value` (text columns only) and `is [not] null`.
+Comparisons combine with and, or, not & parentheses, nested at most MAX_DEPTH deep.
+
+Parsing and compiling are cached by the filter's shape, its structure without the values, so repeat
+filters skip both steps and postgres sees the same parameterized sql every time
+"""
+import operator
+import re
+from datetime import date, datetime
+from functools import lru_cache
+
+from sqlalchemy import and_, bindparam, not_, or_
+
+TOKENS = re.compile(
+    r"""\s*(?:
+    (?P<string>'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")
+    |(?P<number>-?\d+(?:\.\d+)?)(?![\w.])
+    |(?P<op><=|>=|!=|=|<|>)
+    |(?P<punct>[(),])
+    |(?P<word>[A-Za-z_][A-Za-z0-9_]*)
+    )""",
+    re.VERBOSE,
+)
+
+COMPARISONS = {
+    "=": "eq", "eq": "eq",
+    "!=": "ne", "ne": "ne",
+    "<": "lt", "lt": "lt",
+    "<=": "le", "le": "le",
+    ">": "gt", "gt": "gt",
+    ">=": "ge", "ge": "ge",
+}
+OPERATORS = {
+    "eq": operator.eq,
+    "ne": operator.ne,
+    "lt": operator.lt,
+    "le": operator.le,
+    "gt": operator.gt,
+    "ge": operator.ge,
+}
+LITERALS = {"true": True, "false": False}
+# deeper nesting of parentheses & nots is rejected before it can exhaust the stack
+MAX_DEPTH = 32
+MAX_LENGTH = 4096
+
+
+class FilterError(ValueError):
+    pass
+
+
+def tokenize(q: str):
+    tokens = []
+    position = 0
+    q = q.rstrip()
+    while position < len(q):
+        match = TOKENS.match(q, position)
+        if not match or match.end() == position:
+            raise FilterError(f"Unexpected character at {position}")
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == "string":
+            value = re.sub(r"\\(.)", r"\1", value[1:-1])
+        elif kind == "number":
+            value = float(value) if "." in value else int(value)
+        elif kind == "word" and value.lower() in LITERALS:
+            kind, value = "literal", LITERALS[value.lower()]
+        tokens.append((kind, value))
+        position = match.end()
+    return tokens
+
+
+class Parser:
+    """
+    Recursive descent parser producing the filter's shape & its values in order
+    """
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.position = 0
+        self.values = []
+        self.depth = 0
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else (None, None)
+
+    def take(self):
+        token = self.peek()
+        self.position += 1
+        return token
+
+    def keyword(self, *words):
+        kind, value = self.peek()
+        return kind == "word" and value.lower() in words
+
+    def expect_keyword(self, word):
+        if not self.keyword(word):
+            raise FilterError(f"Expected {word}")
+        self.take()
+
+    def expect(self, kind, value=None):
+        token = self.take()
+        if token[0] != kind or (value is not None and token[1] != value):
+            raise FilterError(f"Expected {value or kind}")
+        return token[1]
+
+    def parse(self):
+        if not self.tokens:
+            raise FilterError("Empty filter")
+        shape = self.expression()
+        if self.position != len(self.tokens):
+            raise FilterError("Unexpected input after filter")
+        return shape, tuple(self.values)
+
+    def expression(self):
+        terms = [self.term()]
+        while self.keyword("or"):
+            self.take()
+            terms.append(self.term())
+        return terms[0] if len(terms) == 1 else ("or", tuple(terms))
+
+    def term(self):
+        factors = [self.factor()]
+        while self.keyword("and"):
+            self.take()
+            factors.append(self.factor())
+        return factors[0] if len(factors) == 1 else ("and", tuple(factors))
+
+    def factor(self):
+        if self.keyword("not"):
+            self.take()
+            return ("not", self.nested(self.factor))
+        if self.peek() == ("punct", "("):
+            self.take()
+            shape = self.nested(self.expression)
+            self.expect("punct", ")")
+            return shape
+        return self.comparison()
+
+    def nested(self, parse):
+        self.depth += 1
+        if self.depth > MAX_DEPTH:
+            raise FilterError(f"Filters can't be nested more than {MAX_DEPTH} deep")
+        shape = parse()
+        self.depth -= 1
+        return shape
+
+    def value(self):
+        kind, value = self.take()
+        if kind not in ("string", "number", "literal"):
+            raise FilterError("Expected a value")
+        self.values.append(value)
+
+    def comparison(self):
+        field = self.expect("word")
+        kind, op = self.peek()
+        if kind == "op" or (kind == "word" and op.lower() in COMPARISONS):
+            self.take()
+            self.value()
+            return ("cmp", field, COMPARISONS[op.lower()])
+        if self.keyword("in"):
+            self.take()
+            self.expect("punct", "(")
+            items = []
+            while True:
+                kind, value = self.take()
+                if kind not in ("string", "number", "literal"):
+                    raise FilterError("Expected a value")
+                items.append(value)
+                if self.peek() != ("punct", ","):
+                    break
+                self.take()
+            self.expect("punct", ")")
+            self.values.append(tuple(items))
+            return ("in", field)
+        if self.keyword("between"):
+            self.take()
+            self.value()
+            self.expect_keyword("and")
+            self.value()
+            return ("between", field)
+        if self.keyword("startswith"):
+            self.take()
+            self.value()
+            return ("startswith", field)
+        if self.keyword("is"):
+            self.take()
+            negated = self.keyword("not")
+            if negated:
+                self.take()
+            self.expect_keyword("null")
+            return ("null", field, negated)
+        raise FilterError(f"Expected an operator after {field}")
+
+
+@lru_cache(maxsize=1024)
+def parse_filter(q: str):
+    """
+    Returns the filter's shape & values
+    """
+    if len(q) > MAX_LENGTH:
+        raise FilterError(f"Filters can't be longer than {MAX_LENGTH} characters")
+    return Parser(tokenize(q)).parse()
+
+
+def _python_type(column):
+    try:
+        return column.type.python_type
+    except NotImplementedError:
+        return None
+
+
+def _converter(column):
+    python_type = _python_type(column)
+    if python_type is None:
+        return lambda value: value
+
+    def convert(value):
+        if isinstance(value, tuple):
+            return [convert(v) for v in value]
+        if python_type is bool:
+            if not isinstance(value, bool):
+                raise FilterError(f"{column.key} must be true or false")
+            return value
+        if python_type in (datetime, date):
+            if not isinstance(value, str):
+                raise FilterError(f"{column.key} must be a quoted iso date")
+            try:
+                return python_type.fromisoformat(value)
+            except ValueError:
+                raise FilterError(f"{column.key} must be a quoted iso date")
+        if python_type is int:
+            if isinstance(value, bool) or not isinstance(value, (int, str)):
+                raise FilterError(f"{column.key} must be an integer")
+            try:
+                return int(value)
+            except ValueError:
+                raise FilterError(f"{column.key} must be an integer")
+        if python_type is str:
+            return value if isinstance(value, str) else str(value)
+        return value
+
+    return convert
+
+
+def _like_prefix(value):
+    escaped = str(value).replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"{escaped}%"
+
+
+@lru_cache(maxsize=512)
+def compile_shape(meta, shape):
+    """
+    Compiles a filter shape for a model into an expression with a bind parameter per value,
+    plus the converters that turn the parsed values into parameter values
+    """
+    converters = []
+
+    def param(column, convert=None):
+        name = f"q_{len(converters)}"
+        converters.append((name, convert or _converter(column)))
+        return bindparam(name, type_=column.type)
+
+    def column_for(field):
+        if field not in meta.public_columns:
+            raise FilterError(f"Can't filter on {field}")
+        if meta.filter_indexed_only and field not in meta.indexed_columns:
+            raise FilterError(f"Can't filter on {field}, it isn't indexed")
+        return getattr(meta.model, field)
+
+    def build(node):
+        kind = node[0]
+        if kind == "or":
+            return or_(*[build(n) for n in node[1]])
+        if kind == "and":
+            return and_(*[build(n) for n in node[1]])
+        if kind == "not":
+            return not_(build(node[1]))
+        column = column_for(node[1])
+        if kind == "cmp":
+            return OPERATORS[node[2]](column, param(column))
+        if kind == "in":
+            name = f"q_{len(converters)}"
+            converters.append((name, _converter(column)))
+            return column.in_(bindparam(name, expanding=True))
+        if kind == "between":
+            return column.between(param(column), param(column))
+        if kind == "startswith":
+            if _python_type(column) is not str:
+                raise FilterError(f"{node[1]} isn't text, startswith only works on text")
+            return column.like(param(column, _like_prefix), escape="\\")
+        if kind == "null":
+            return column.is_not(None) if node[2] else column.is_(None)
+        raise FilterError("Invalid filter")
+
+    return build(shape), tuple(converters)
+
+
+def compile_filter(meta, q: str):
+    """
+    Parses & validates `q` against the model, returning a sqlalchemy expression with bound values
+    """
+    shape, values = parse_filter(q)
+    expression, converters = compile_shape(meta, shape)
+    return expression.params({name: convert(v) for (name, convert), v in zip(converters, values)})
+
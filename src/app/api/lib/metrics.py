@@ -0,0 +1,386 @@
+"""
+In process metrics rendered in the prometheus text format.
+
+Updates are plain dict & list operations with no locks, they're cheap enough to leave on in production.
+Under threads an increment can very rarely be lost, which is fine for monitoring
+"""
+import logging
+import re
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from sqlalchemy import event
+
+logger = logging.getLogger("metrics")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.values = {}
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+    def samples(self):
+        return [f"{self.name}{_labels(self.label_names, k)} {v}" for k, v in list(self.values.items())]
+
+    def render(self):
+        return self.header() + self.samples()
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    """
+    A value that goes up & down. Pass `collect` to read the values when scraped instead,
+    it returns a dict of label values to values
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labels=(), collect=None):
+        super().__init__(name, help, labels)
+        self.collect = collect
+
+    def set(self, value, *labels):
+        self.values[labels] = value
+
+    def inc(self, *labels, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+    def samples(self):
+        if self.collect is not None:
+            self.values = dict(self.collect())
+        return super().samples()
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels):
+        series = self.values.get(labels)
+        if series is None:
+            # a count per bucket plus +Inf, then the sum
+            series = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def samples(self):
+        lines = []
+        names = self.label_names + ("le",)
+        for labels, series in list(self.values.items()):
+            total = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                total += count
+                lines.append(f"{self.name}_bucket{_labels(names, labels + (bound,))} {total}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, labels)} {series[-1]}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, labels)} {total}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+requests_total = registry.register(
+    Counter("http_requests_total", "Requests handled", ("method", "route", "resource", "status"))
+)
+request_seconds = registry.register(
+    Histogram("http_request_duration_seconds", "Request latency", ("method", "route", "resource"))
+)
+requests_in_flight = registry.register(Gauge("http_requests_in_flight", "Requests being handled"))
+request_queries = registry.register(
+    Histogram("db_queries_per_request", "Queries run by a request", ("route",), buckets=COUNT_BUCKETS)
+)
+request_query_seconds = registry.register(
+    Histogram("db_query_duration_seconds_per_request", "Time a request spent running queries", ("route",))
+)
+queries_total = registry.register(Counter("db_queries_total", "Queries run", ("engine",)))
+checkouts_total = registry.register(Counter("db_pool_checkouts_total", "Connections checked out", ("engine",)))
+checkout_wait_seconds = registry.register(
+    Histogram("db_pool_checkout_wait_seconds", "Time waiting for a connection", ("engine",))
+)
+
+
+slow_queries_total = registry.register(Counter("db_slow_queries_total", "Queries over the slow threshold", ("route",)))
+
+
+class RequestStats:
+    """
+    Timings for the current request. `timings` holds named spans like auth & serialize
+    """
+
+    __slots__ = ("scope", "routes", "queries", "query_seconds", "timings")
+
+    def __init__(self, scope: dict, routes: dict):
+        self.scope = scope
+        self.routes = routes
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.timings = {}
+
+    @property
+    def route(self) -> str:
+        # the router adds the endpoint to the scope once it has matched
+        return self.routes.get(self.scope.get("endpoint"), "unmatched")
+
+    def server_timing(self, total: float) -> str:
+        entries = [f'db;dur={self.query_seconds * 1000:.1f};desc="{self.queries} queries"']
+        entries += [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.timings.items()]
+        entries.append(f"total;dur={total * 1000:.1f}")
+        return ", ".join(entries)
+
+
+# the current request's stats, the sqlalchemy events add to it
+request_stats: ContextVar = ContextVar("request_stats", default=None)
+
+
+@contextmanager
+def timed(name: str):
+    """
+    Adds the time spent in the block to the current request's `name` timing
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats = request_stats.get()
+        if stats is not None:
+            stats.timings[name] = stats.timings.get(name, 0.0) + time.perf_counter() - start
+
+
+PLACEHOLDER = r"(?:\$\d+|%\(\w+\)s|%s|\?)"
+PLACEHOLDER_LISTS = re.compile(rf"{PLACEHOLDER}(?:\s*,\s*{PLACEHOLDER})+")
+PLACEHOLDERS = re.compile(PLACEHOLDER)
+
+
+def normalize_statement(statement: str) -> str:
+    """
+    Collapses whitespace & placeholders so the same query with a different number of IN values
+    has the same shape
+    """
+    statement = " ".join(statement.split())
+    statement = PLACEHOLDER_LISTS.sub("?, ...", statement)
+    return PLACEHOLDERS.sub("?", statement)
+
+
+def parameter_shape(parameters):
+    """
+    The parameters' types without their values, so nothing sensitive is logged
+    """
+    if isinstance(parameters, dict):
+        return {key: type(value).__name__ for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        if parameters and isinstance(parameters[0], (dict, list, tuple)):
+            return f"{len(parameters)} x {parameter_shape(parameters[0])}"
+        return [type(value).__name__ for value in parameters]
+    return type(parameters).__name__
+
+
+class SlowQueryLog:
+    """
+    Logs queries slower than `threshold` seconds, aggregated by statement shape so repeat offenders
+    show their count & total time. Keeps the `maxsize` most recently seen shapes
+    """
+
+    def __init__(self, threshold: float, maxsize: int = 1000):
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self.shapes = OrderedDict()
+
+    def record(self, statement: str, parameters, route: str, seconds: float):
+        if seconds < self.threshold:
+            return
+        shape = normalize_statement(statement)
+        entry = self.shapes.pop(shape, None) or {"count": 0, "total": 0.0, "max": 0.0}
+        entry["count"] += 1
+        entry["total"] += seconds
+        entry["max"] = max(entry["max"], seconds)
+        self.shapes[shape] = entry
+        while len(self.shapes) > self.maxsize:
+            self.shapes.popitem(last=False)
+        slow_queries_total.inc(route)
+        logger.warning(
+            "slow query %.1fms on %s, seen %d times for %.1fms total: %s params=%s",
+            seconds * 1000,
+            route,
+            entry["count"],
+            entry["total"] * 1000,
+            shape,
+            parameter_shape(parameters),
+        )
+
+    def top(self, n: int = 10):
+        """
+        The shapes that have taken the most time
+        """
+        return sorted(self.shapes.items(), key=lambda item: item[1]["total"], reverse=True)[:n]
+
+# engine name to pool, read when scraped
+pools = {}
+
+
+def _pool_values(attribute):
+    def collect():
+        values = {}
+        for name, pool in list(pools.items()):
+            method = getattr(pool, attribute, None)
+            if method is not None:
+                values[(name,)] = method()
+        return values
+
+    return collect
+
+
+registry.register(
+    Gauge("db_pool_checked_out", "Connections checked out", ("engine",), collect=_pool_values("checkedout"))
+)
+registry.register(
+    Gauge("db_pool_overflow", "Connections open beyond pool_size", ("engine",), collect=_pool_values("overflow"))
+)
+registry.register(Gauge("db_pool_size", "Pool size", ("engine",), collect=_pool_values("size")))
+
+
+def instrument_engine(engine, name: str, slow_queries: SlowQueryLog = None, collect: bool = True):
+    """
+    Counts & times queries and checkouts on a sync engine, for async engines pass `async_engine.sync_engine`.
+    Without `collect` only the request's query stats & the slow query log are kept, not the prometheus series
+    """
+    if name in pools:
+        return
+    pools[name] = engine.pool
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info["query_start"] = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"]
+        if collect:
+            queries_total.inc(name)
+        stats = request_stats.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.query_seconds += elapsed
+        if slow_queries is not None:
+            slow_queries.record(statement, parameters, stats.route if stats else "", elapsed)
+
+    if collect:
+        @event.listens_for(engine, "checkout")
+        def checkout(dbapi_connection, connection_record, connection_proxy):
+            checkouts_total.inc(name)
+
+
+def observe_checkout_wait(engine, seconds: float):
+    for name, pool in pools.items():
+        if pool is engine.pool:
+            checkout_wait_seconds.observe(seconds, name)
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware recording latency by route template, e.g. /api/v1/{resource}/{recordid},
+    and the resource it resolved to. `routes` maps endpoints to their templates.
+    With `server_timing` responses get a Server-Timing header splitting out db time & the `timed` spans.
+    Without `collect` it only keeps the request's stats for the header & the slow query log
+    """
+
+    def __init__(self, app, routes: dict, resources=None, server_timing: bool = False, collect: bool = True):
+        self.app = app
+        self.routes = routes
+        self.resources = resources
+        self.server_timing = server_timing
+        self.collect = collect
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status_code = 500
+        stats = RequestStats(scope, self.routes)
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if self.server_timing:
+                    timing = stats.server_timing(time.perf_counter() - start)
+                    message["headers"] = list(message.get("headers", [])) + [
+                        (b"server-timing", timing.encode("latin-1"))
+                    ]
+            await send(message)
+
+        token = request_stats.set(stats)
+        if not self.collect:
+            try:
+                return await self.app(scope, receive, send_wrapper)
+            finally:
+                request_stats.reset(token)
+        requests_in_flight.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            requests_in_flight.dec()
+            request_stats.reset(token)
+            route = stats.route
+            resource = self._resource(scope.get("path_params", {}).get("resource"))
+            requests_total.inc(scope["method"], route, resource, status_code)
+            request_seconds.observe(elapsed, scope["method"], route, resource)
+            request_queries.observe(stats.queries, route)
+            request_query_seconds.observe(stats.query_seconds, route)
+
+    def _resource(self, name):
+        # only known resources are used as labels so clients can't create unbounded series
+        if name is None:
+            return ""
+        if self.resources is not None and self.resources.get(name) is None:
+            return "unknown"
+        return name.lower()
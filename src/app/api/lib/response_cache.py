@@ -0,0 +1,118 @@
+"""
+Caches serialized responses keyed on the request, the caller's visibility and a generation per resource.
+Writes bump the resource's generation so old entries are never read again.
+
+`LocalBackend` keeps everything in process, so it's only correct with a single worker. `RedisBackend` shares
+entries & generations between processes, it needs the optional `redis` package
+"""
+import asyncio
+import hashlib
+
+from app.api.lib.cache import TTLCache
+
+try:
+    import redis
+    import redis.asyncio
+except ImportError:  # pragma: no cover - optional dependency
+    redis = None
+
+
+class LocalBackend:
+    def __init__(self, maxsize: int, ttl: float):
+        self.entries = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.generations_by_name = {}
+
+    async def get(self, key: str):
+        return self.entries.get(key)
+
+    async def set(self, key: str, value):
+        self.entries.set(key, value)
+
+    async def generations(self, names) -> list:
+        return [self.generations_by_name.get(name, 0) for name in names]
+
+    def bump(self, name: str):
+        self.generations_by_name[name] = self.generations_by_name.get(name, 0) + 1
+        # entries from older generations can't be read again, free them now
+        self.entries.evict(lambda key, value: key.startswith(f"{name}:"))
+
+
+class RedisBackend:
+    """
+    Generations are redis counters so a write in one process invalidates every process.
+
+    Writes notify listeners synchronously, so a bump made on the event loop is sent in the background and
+    the next `generations` call in this process waits for it. Outside of an event loop, e.g. in scripts,
+    it's sent straight away
+    """
+
+    prefix = "response-cache"
+
+    def __init__(self, url: str, ttl: float):
+        if redis is None:
+            raise RuntimeError("RESPONSE_CACHE_URL needs the redis package installed")
+        self.url = url
+        self.client = redis.asyncio.Redis.from_url(url)
+        self.ttl = int(ttl)
+        self.pending = set()
+        self._sync_client = None
+
+    async def get(self, key: str):
+        value = await self.client.get(f"{self.prefix}:{key}")
+        if value is None:
+            return None
+        etag, body = value.split(b"\n", 1)
+        return body, etag.decode()
+
+    async def set(self, key: str, value):
+        body, etag = value
+        await self.client.set(f"{self.prefix}:{key}", etag.encode() + b"\n" + body, ex=self.ttl)
+
+    async def generations(self, names) -> list:
+        if self.pending:
+            await asyncio.gather(*self.pending)
+        # one round trip for every resource the response reads
+        values = await self.client.mget([f"{self.prefix}:generation:{name}" for name in names])
+        return [int(value or 0) for value in values]
+
+    def bump(self, name: str):
+        key = f"{self.prefix}:generation:{name}"
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            if self._sync_client is None:
+                self._sync_client = redis.Redis.from_url(self.url)
+            self._sync_client.incr(key)
+            return
+        task = loop.create_task(self.client.incr(key))
+        self.pending.add(task)
+        task.add_done_callback(self.pending.discard)
+
+
+class ResponseCache:
+    """
+    Entries are (body, etag) pairs. Bodies over `max_bytes` aren't cached
+    """
+
+    def __init__(self, backend, max_bytes: int):
+        self.backend = backend
+        self.max_bytes = max_bytes
+
+    async def key(self, names, scope: str, *params) -> str:
+        """
+        `names` are the resources the response reads, the first is the resource requested
+        """
+        generations = await self.backend.generations(names)
+        versions = ",".join(f"{name}.{generation}" for name, generation in zip(names, generations))
+        digest = hashlib.blake2b("|".join(str(p) for p in params).encode(), digest_size=16).hexdigest()
+        return f"{names[0]}:{versions}:{scope}:{digest}"
+
+    async def get(self, key: str):
+        return await self.backend.get(key)
+
+    async def set(self, key: str, body: bytes, etag: str):
+        if len(body) <= self.max_bytes:
+            await self.backend.set(key, (body, etag))
+
+    def invalidate(self, name: str):
+        self.backend.bump(name)
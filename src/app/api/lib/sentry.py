@@ -0,0 +1,47 @@
+import sentry_sdk
+
+
+class SentryMiddleware:
+    """
+    Pure ASGI middleware reporting unhandled exceptions to sentry. Requests & responses, streamed ones
+    included, pass straight through, it only does work when something raises or a trace is sampled
+    """
+
+    def __init__(self, app, traces_sample_rate: float = 0.0, routes: dict = None):
+        self.app = app
+        self.tracing = traces_sample_rate > 0
+        # the dict is filled in after the middleware is added, it has to be kept even while empty
+        self.routes = routes if routes is not None else {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        if not self.tracing:
+            try:
+                return await self.app(scope, receive, send)
+            except Exception as e:
+                self.capture(scope, e)
+                raise
+        with sentry_sdk.start_transaction(op="http.server", name=scope["path"]) as transaction:
+            try:
+                await self.app(scope, receive, send)
+            except Exception as e:
+                self.capture(scope, e)
+                raise
+            finally:
+                # named after the route template so traces group, the router sets the endpoint on the scope
+                transaction.name = self.routes.get(scope.get("endpoint"), scope["path"])
+
+    def capture(self, scope, exception):
+        with sentry_sdk.push_scope() as sentry_scope:
+            # headers are left out, they carry auth tokens
+            sentry_scope.set_context(
+                "request",
+                {
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "route": self.routes.get(scope.get("endpoint")),
+                    "query_string": scope.get("query_string", b"").decode("latin-1"),
+                },
+            )
+            sentry_sdk.capture_exception(exception)
@@ -30,8 +30,10 @@ class ResetPasswordIn(BaseModel):
 
 
 class ListResource(BaseModel):
-    total: int
+    total: Optional[int] = None
     data: List[Any]  # TODO: I think pydantic has a generic model that can be used
+    next_cursor: Optional[str] = None
+    has_more: Optional[bool] = None
 
 
 class UserIn(BaseModel):
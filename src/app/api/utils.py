@@ -1,5 +1,27 @@
+import base64
+import json
+from datetime import date, datetime
 from typing import Optional
-from sqlalchemy import text
+from fastapi import HTTPException, Request, status
+from app.api.lib.filters import FilterError, compile_filter
+from app.db.session import RequestSession
+from app.exceptions import Codes
+
+
+async def get_db(request: Request):
+    """
+    The request's lazily opened session, closed once the response has been sent.
+    GET requests can read from a replica
+    """
+    if hasattr(request.state, "db"):
+        # dependencies under Security() are cached separately, so auth & the handler both get here
+        yield request.state.db
+        return
+    session = request.state.db = RequestSession(read_only=request.method in ("GET", "HEAD"))
+    try:
+        yield session
+    finally:
+        await session.close()
 
 
 async def common_params(
@@ -8,15 +30,109 @@ async def common_params(
     limit: int = 100,
     sort: str = "id",
     sortDir: str = "desc",
+    after: Optional[str] = None,
+    count: Optional[str] = None,
+    fields: Optional[str] = None,
+    include: Optional[str] = None,
 ):
+    if count not in (None, "exact", "estimate", "none") or sortDir.lower() not in ("asc", "desc"):
+        raise Codes.INVALID_REQUEST
+    cursor = decode_cursor(after) if after else None
+    if cursor and (cursor["sort"], cursor["sort_dir"]) != (sort, sortDir.lower()):
+        # a cursor only makes sense for the ordering it was issued for
+        raise Codes.INVALID_REQUEST
     return {
-        "q": text(q) if q else None,
+        "q": q,
         "page": page * limit,
         "limit": limit,
-        "sort_by": text(" ".join([sort, sortDir])),
+        "sort": sort,
+        "sort_dir": sortDir.lower(),
+        "after": cursor,
+        "count": count,
+        "fields": fields,
+        "include": include,
     }
 
 
+def resolve_params(meta, params: dict) -> dict:
+    """
+    Validates the list params that depend on the model & compiles the `q` filter
+    """
+    if params["sort"] not in meta.public_columns:
+        raise Codes.INVALID_REQUEST
+    params["fields"] = parse_fields(meta, params["fields"])
+    params["include"] = parse_include(meta, params["include"])
+    if params["q"]:
+        try:
+            params["q"] = compile_filter(meta, params["q"])
+        except FilterError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid filter: {e}")
+    else:
+        params["q"] = None
+    return params
+
+
+def parse_fields(meta, fields: Optional[str]):
+    """
+    Validates a comma separated `fields` param against the model's public columns
+    """
+    if not fields:
+        return None
+    requested = {f.strip() for f in fields.split(",") if f.strip()}
+    if not requested or any(f not in meta.public_columns for f in requested):
+        raise Codes.INVALID_REQUEST
+    # in column order so every ordering of the same fields shares one serializer & cache entry
+    return tuple(c for c in meta.public_columns if c in requested)
+
+
+def parse_include(meta, include: Optional[str]):
+    """
+    Validates a comma separated `include` param against the model's relationships
+    """
+    if not include:
+        return None
+    requested = {i.strip() for i in include.split(",") if i.strip()}
+    if not requested or any(i not in meta.relationships for i in requested):
+        raise Codes.INVALID_REQUEST
+    return tuple(r for r in meta.relationships if r in requested)
+
+
+def _cursor_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+def encode_cursor(sort: str, sort_dir: str, value, record_id: int) -> str:
+    """
+    Opaque token for the last row of a page: the sort key plus the id as a tiebreaker
+    """
+    payload = json.dumps([sort, sort_dir, value, record_id], default=_cursor_default)
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> dict:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        sort, sort_dir, value, record_id = json.loads(base64.urlsafe_b64decode(padded))
+    except (ValueError, TypeError):
+        raise Codes.INVALID_REQUEST
+    return {"sort": sort, "sort_dir": sort_dir, "value": value, "id": record_id}
+
+
+def next_cursor(params: dict, results: list) -> Optional[str]:
+    """
+    Returns the cursor for the page after `results`, or None when there can't be another page
+    """
+    if not results or len(results) < params["limit"]:
+        return None
+    last = results[-1]
+    value = getattr(last, params["sort"])
+    if value is None:
+        return None
+    return encode_cursor(params["sort"], params["sort_dir"], value, last.id)
+
+
 def copy_attributes(source, destination):
     """
     Copies attributes from `source` object to `destination` object if they exist in both objects
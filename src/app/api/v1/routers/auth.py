@@ -1,20 +1,24 @@
 from fastapi import APIRouter, Depends, HTTPException, Response, status
 from fastapi.security import OAuth2PasswordRequestForm
 from app.config import AUTH_COOKIE_ID, ACCESS_TOKEN_EXPIRE_MINUTES
-from app.api.auth import authenticate_user, create_access_token, get_password_hash
+from app.api.auth import authenticate_user, create_access_token, hash_password
 from app.api.schemas import Token, UserOut, PasswordIn
-from app.db.session import SessionManager
-from app.db.crud import save_resource
+from app.api.utils import get_db
+from app.db.session import RequestSession
+from app.db.async_crud import save_resource
 from app.db.models import User
+from sqlalchemy import select
 from datetime import timedelta
 router = APIRouter(prefix="/api/v1")
 
 
 @router.post("/token", response_model=Token)
 async def login_for_access_token(
-    response: Response, form_data: OAuth2PasswordRequestForm = Depends()
+    response: Response,
+    form_data: OAuth2PasswordRequestForm = Depends(),
+    session: RequestSession = Depends(get_db),
 ):
-    user = authenticate_user(form_data.username, form_data.password)
+    user = await authenticate_user(session, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -38,18 +42,20 @@ async def login_for_access_token(
 
 
 @router.post("/token/{token}")
-async def validate_access_token(token: str, p: PasswordIn):
-    with SessionManager() as db:
-        user = db.query(User).filter(User.reset_token == token).first()
-        if user:
-            user.reset_token = None
-            user.password = get_password_hash(p.password)
-            new_user = save_resource(db, user, user.id)
-            new_user.scopes = new_user.scopes.split(" ")
-            return UserOut.from_orm(user)
-        else:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Token not valid or expired",
-                headers={"WWW-Authenticate": "Bearer"},
-            )
+async def validate_access_token(
+    token: str, p: PasswordIn, session: RequestSession = Depends(get_db)
+):
+    db = await session.get()
+    user = (await db.execute(select(User).filter(User.reset_token == token))).scalars().first()
+    if user:
+        user.reset_token = None
+        user.password = await hash_password(p.password)
+        new_user = await save_resource(db, user, user.id)
+        new_user.scopes = new_user.scopes.split(" ")
+        return UserOut.from_orm(user)
+    else:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Token not valid or expired",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
@@ -1,56 +1,201 @@
-import inspect
-from fastapi import APIRouter, Depends, Security, Request
-from app.db.session import SessionManager
-from app.api.utils import common_params
-from app.db.crud import (
-    save_resource, update_resource, list_resource, query_by_external_id, delete
+import logging
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Security, Request, Response, status
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from sqlalchemy.exc import IntegrityError
+from app.db.session import RequestSession
+from app.api.utils import common_params, get_db, next_cursor, parse_fields, parse_include, resolve_params
+from app.db.async_crud import (
+    save_resource,
+    update_resource,
+    list_resource,
+    query_by_external_id,
+    delete,
+    stream_resource,
+    bulk_resource,
+    list_version,
 )
+from app.db.crud import included_modified, is_keyset_sort, on_write
+from app.db.session import read_keys, replicas
 from app.api.auth import get_current_active_user
 from app.api.schemas import ListResource, UserOut
-from app.config import Scopes
-import app.db.models as models
+from app.api.lib import export
+from app.api.lib.etag import etag_matches, list_etag, record_etag
+from app.api.lib.metrics import timed
+from app.api.lib.response_cache import LocalBackend, RedisBackend, ResponseCache
+from app.api.lib.serializers import JSONBytesResponse, get_serializer
+from app.config import (
+    Scopes,
+    EXPORT_BATCH_SIZE,
+    BULK_MAX_ITEMS,
+    RESPONSE_CACHE_SIZE,
+    RESPONSE_CACHE_TTL,
+    RESPONSE_CACHE_MAX_BYTES,
+    RESPONSE_CACHE_URL,
+    WEB_CONCURRENCY,
+)
+from app.db.registry import resources
 from app.exceptions import Codes
 
-router = APIRouter(prefix=f"/api/v1")
+logger = logging.getLogger("response_cache")
+
+router = APIRouter(prefix=f"/api/v1", default_response_class=ORJSONResponse)
+
+response_cache = None
+if RESPONSE_CACHE_URL:
+    response_cache = ResponseCache(RedisBackend(RESPONSE_CACHE_URL, RESPONSE_CACHE_TTL), RESPONSE_CACHE_MAX_BYTES)
+elif RESPONSE_CACHE_SIZE and WEB_CONCURRENCY > 1:
+    # a write only invalidates the worker that made it, the others would keep serving what they cached
+    logger.warning("the in process response cache is off with %d workers, set RESPONSE_CACHE_URL", WEB_CONCURRENCY)
+elif RESPONSE_CACHE_SIZE:
+    response_cache = ResponseCache(LocalBackend(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL), RESPONSE_CACHE_MAX_BYTES)
+
+
+@on_write
+def invalidate_cached_responses(model, records):
+    if response_cache is not None:
+        response_cache.invalidate(resources.for_model(model).name)
 
 
-async def get_request_body(request: Request, model):
+async def get_request_body(request: Request, meta):
     req = await request.json()
-    return model(**req)
+    return meta.model(**meta.writable(req))
 
 
-def get_resource_model(resource: str):
-    resource_dict = {r[0]: r[1] for r in inspect.getmembers(models, inspect.isclass)}
-    if resource.title() in resource_dict:
-        return resource_dict.get(resource.title())
-    else:
+def get_resource(resource: str):
+    meta = resources.get(resource)
+    if meta is None:
         raise Codes.NOT_FOUND
+    return meta
+
+
+def visibility_scope(u):
+    return Scopes.ADMIN if Scopes.ADMIN in u.scopes else f"user:{u.id}"
+
 
+def not_modified(etag: str):
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
 
-@router.get("/{resource}")
+
+async def cache_key(meta, u, include, *params):
+    if response_cache is None:
+        return None
+    # included relationships are part of the response, so their writes invalidate it too
+    names = [meta.name] + [resources.for_model(meta.relationships[key]).name for key in include or ()]
+    return await response_cache.key(names, visibility_scope(u), *params)
+
+
+async def cached_response(request: Request, key):
+    cached = await response_cache.get(key) if key else None
+    if cached is None:
+        return None
+    body, etag = cached
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return not_modified(etag)
+    return JSONBytesResponse(body, headers={"ETag": etag})
+
+
+async def cache_response(session: RequestSession, meta, key, body: bytes, etag: str):
+    # a replica can lag behind a write that just invalidated the cache, don't keep what it returned
+    if key and not (session.on_replica and replicas.written_recently(*read_keys(model=meta.model))):
+        await response_cache.set(key, body, etag)
+
+
+@router.get("/{resource}", response_model=ListResource)
 async def list_records(
     resource: str,
+    request: Request,
     commons=Depends(common_params),
     u: UserOut = Security(get_current_active_user, scopes=[Scopes.USER]),
+    session: RequestSession = Depends(get_db),
+):
+    meta = get_resource(resource)
+    commons = resolve_params(meta, commons)
+    keyset = is_keyset_sort(meta.model, commons)
+    if commons["after"] is not None and not keyset:
+        # cursors can only seek on indexed columns
+        raise Codes.INVALID_REQUEST
+    key = await cache_key(meta, u, commons["include"], "list", sorted(request.query_params.multi_items()))
+    cached = await cached_response(request, key)
+    if cached is not None:
+        return cached
+    db = await session.get(user_id=u.id)
+    modified, archived = await list_version(db, meta.model, u, commons["include"])
+    etag = list_etag(modified, archived, request.query_params, visibility_scope(u))
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return not_modified(etag)
+    results, total, has_more = await list_resource(db, meta.model, commons, u)
+    cursor = next_cursor(commons, results) if keyset and has_more is not False else None
+    with timed("serialize"):
+        content = get_serializer(meta, commons["fields"], commons["include"]).dumps_list(
+            results, total=total, next_cursor=cursor, has_more=has_more
+        )
+    await cache_response(session, meta, key, content, etag)
+    return JSONBytesResponse(content, headers={"ETag": etag})
+
+
+@router.get("/{resource}/export")
+async def export_records(
+    resource: str,
+    format: str = "ndjson",
+    u: UserOut = Security(get_current_active_user, scopes=[Scopes.USER]),
+    session: RequestSession = Depends(get_db),
 ):
-    with SessionManager() as db:
-        model = get_resource_model(resource)
-        results, total = list_resource(db, model, commons, u)
-        return ListResource(data=results, total=total)
+    meta = get_resource(resource)
+    if format not in export.MEDIA_TYPES:
+        raise Codes.INVALID_REQUEST
+    if format == "arrow" and export.pa is None:
+        raise Codes.NOT_IMPLEMENTED
+
+    columns = meta.public_columns
+
+    async def rows():
+        # the request's session stays open until the response has been streamed
+        db = await session.get(user_id=u.id)
+        async for partition in stream_resource(db, meta.model, u, EXPORT_BATCH_SIZE):
+            yield partition
+
+    if format == "ndjson":
+        chunks = export.ndjson_chunks(columns, rows())
+    elif format == "csv":
+        chunks = export.csv_chunks(columns, rows())
+    else:
+        chunks = export.arrow_chunks(columns, rows(), [meta.columns[c] for c in columns])
+    return StreamingResponse(
+        chunks,
+        media_type=export.MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{meta.name}.{format}"'},
+    )
 
 
 @router.get("/{resource}/{recordid}")
 async def get_record(
     resource: str,
     recordid: str,
+    request: Request,
+    fields: Optional[str] = None,
+    include: Optional[str] = None,
     u: UserOut = Security(get_current_active_user, scopes=[Scopes.USER]),
+    session: RequestSession = Depends(get_db),
 ):
-    model = get_resource_model(resource)
-    with SessionManager() as db:
-        record = query_by_external_id(db, model, recordid, u)
-        if not record:
-            raise Codes.NOT_FOUND
-        return record
+    meta = get_resource(resource)
+    fields = parse_fields(meta, fields)
+    include = parse_include(meta, include)
+    key = await cache_key(meta, u, include, "get", recordid, fields, include)
+    cached = await cached_response(request, key)
+    if cached is not None:
+        return cached
+    db = await session.get(user_id=u.id)
+    record = await query_by_external_id(db, meta.model, recordid, u, fields, include)
+    if not record:
+        raise Codes.NOT_FOUND
+    etag = record_etag(record, fields, include, included_modified(record, include))
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return not_modified(etag)
+    with timed("serialize"):
+        content = get_serializer(meta, fields, include).dumps(record)
+    await cache_response(session, meta, key, content, etag)
+    return JSONBytesResponse(content, headers={"ETag": etag})
 
 
 @router.post("/{resource}")
@@ -58,12 +203,35 @@ async def create_record(
     resource: str,
     request: Request,
     u: UserOut = Security(get_current_active_user, scopes=[Scopes.USER]),
+    session: RequestSession = Depends(get_db),
 ):
-    model = get_resource_model(resource)
-    data = await get_request_body(request, model)
-    with SessionManager() as db:
-        record = save_resource(db, data, u.id)
-        return record
+    meta = get_resource(resource)
+    data = await get_request_body(request, meta)
+    db = await session.get()
+    record = await save_resource(db, data, u.id)
+    return JSONBytesResponse(get_serializer(meta).dumps(record))
+
+
+@router.post("/{resource}/bulk")
+async def bulk_records(
+    resource: str,
+    request: Request,
+    u: UserOut = Security(get_current_active_user, scopes=[Scopes.USER]),
+    session: RequestSession = Depends(get_db),
+):
+    meta = get_resource(resource)
+    operations = await request.json()
+    if not isinstance(operations, list) or len(operations) > BULK_MAX_ITEMS:
+        raise Codes.INVALID_REQUEST
+    db = await session.get()
+    try:
+        plan = await bulk_resource(db, meta.model, operations, u)
+    except IntegrityError:
+        await db.rollback()
+        raise Codes.INVALID_REQUEST
+    if plan.errors:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=plan.results)
+    return {"results": plan.results}
 
 
 @router.put("/{resource}/{recordid}")
@@ -72,15 +240,16 @@ async def update_record(
     recordid: str,
     request: Request,
     u: UserOut = Security(get_current_active_user, scopes=[Scopes.USER]),
+    session: RequestSession = Depends(get_db),
 ):
-    model = get_resource_model(resource)
-    with SessionManager() as db:
-        existing_record = query_by_external_id(db, model, recordid, u)
-        if not existing_record:
-            raise Codes.NOT_FOUND
-        data = await request.json()
-        record = update_resource(db, existing_record, data, u.id)
-        return record
+    meta = get_resource(resource)
+    db = await session.get()
+    existing_record = await query_by_external_id(db, meta.model, recordid, u)
+    if not existing_record:
+        raise Codes.NOT_FOUND
+    data = await request.json()
+    record = await update_resource(db, existing_record, data, u.id)
+    return JSONBytesResponse(get_serializer(meta).dumps(record))
 
 
 @router.delete("/{resource}/{recordid}")
@@ -88,11 +257,12 @@ async def delete_record(
     resource: str,
     recordid: str,
     u: UserOut = Security(get_current_active_user, scopes=[Scopes.USER]),
+    session: RequestSession = Depends(get_db),
 ):
-    model = get_resource_model(resource)
-    with SessionManager() as db:
-        record = query_by_external_id(db, model, recordid, u)
-        if not record:
-            return Codes.NOT_FOUND
-        delete(db, record, u.id)
-        return
+    meta = get_resource(resource)
+    db = await session.get()
+    record = await query_by_external_id(db, meta.model, recordid, u)
+    if not record:
+        raise Codes.NOT_FOUND
+    await delete(db, record, u.id)
+    return
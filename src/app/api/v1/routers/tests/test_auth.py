@@ -0,0 +1,29 @@
+from passlib.context import CryptContext
+from passlib.hash import bcrypt
+
+from app.api import auth
+from app.config import Scopes
+from app.db.models import User
+
+
+def test_login_upgrades_outdated_hash(client, db_connection, monkeypatch):
+    # the stored hash has fewer rounds than the context now asks for
+    context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__min_rounds=5, bcrypt__default_rounds=5)
+    monkeypatch.setattr(auth, "pwd_context", context)
+    outdated = bcrypt.using(rounds=4).hash("rehash-password")
+    user = User(email="rehash@email.com", password=outdated, scopes=Scopes.USER, is_disabled=False)
+    db_connection.add(user)
+    db_connection.commit()
+    try:
+        response = client.post("/api/v1/token", data={"username": user.email, "password": "rehash-password"})
+        assert response.status_code == 200
+
+        db_connection.expire_all()
+        upgraded = db_connection.query(User).filter(User.email == user.email).one().password
+        assert upgraded != outdated
+        assert upgraded.startswith("$2b$05$")
+        assert auth.pwd_context.verify("rehash-password", upgraded)
+        assert not auth.pwd_context.needs_update(upgraded)
+    finally:
+        db_connection.query(User).filter(User.email == "rehash@email.com").delete()
+        db_connection.commit()
@@ -43,4 +43,308 @@ def test_user_update(client, superuser_token_headers, db_connection):
 def test_user_delete(client, superuser_token_headers, db_connection):
     user = db_connection.query(User).filter(User.email == 'test@test.com').first()
     response = client.delete(f"/api/v1/user/{user.external_id}", headers=superuser_token_headers)
-    assert response.status_code == 200
\ No newline at end of file
+    assert response.status_code == 200
+
+def test_non_model_resource_not_found(client, superuser_token_headers):
+    response = client.get("/api/v1/column", headers=superuser_token_headers)
+    assert response.status_code == 404
+
+
+def test_list_cursor_pagination(client, superuser_token_headers, test_user):
+    response = client.get("/api/v1/user?limit=1", headers=superuser_token_headers)
+    assert response.status_code == 200
+    first_page = response.json()
+    assert first_page['next_cursor']
+
+    response = client.get(
+        f"/api/v1/user?limit=1&after={first_page['next_cursor']}", headers=superuser_token_headers
+    )
+    assert response.status_code == 200
+    second_page = response.json()
+    assert second_page['data'][0]['id'] < first_page['data'][0]['id']
+
+
+def test_list_cursor_invalid(client, superuser_token_headers):
+    response = client.get("/api/v1/user?after=notacursor", headers=superuser_token_headers)
+    assert response.status_code == 400
+
+
+def test_list_cursor_unindexed_sort(client, superuser_token_headers, test_user):
+    response = client.get("/api/v1/user?limit=1&sort=first_name", headers=superuser_token_headers)
+    assert response.json()['next_cursor'] is None
+
+
+def test_list_count_none(client, superuser_token_headers, test_user):
+    response = client.get("/api/v1/user?limit=1&count=none", headers=superuser_token_headers)
+    assert response.status_code == 200
+    data = response.json()
+    assert data['total'] is None
+    assert data['has_more'] is True
+    assert len(data['data']) == 1
+
+
+def test_list_count_estimate(client, superuser_token_headers):
+    response = client.get("/api/v1/user?count=estimate", headers=superuser_token_headers)
+    assert response.status_code == 200
+    assert isinstance(response.json()['total'], int)
+
+    response = client.get("/api/v1/user?count=estimate&q=id>0", headers=superuser_token_headers)
+    assert response.status_code == 200
+    assert isinstance(response.json()['total'], int)
+
+
+def test_list_count_invalid(client, superuser_token_headers):
+    response = client.get("/api/v1/user?count=sometimes", headers=superuser_token_headers)
+    assert response.status_code == 400
+
+
+def test_export_ndjson(client, superuser_token_headers):
+    response = client.get("/api/v1/user/export", headers=superuser_token_headers)
+    assert response.status_code == 200
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert rows
+    assert all('password' not in row for row in rows)
+
+
+def test_export_csv(client, superuser_token_headers):
+    response = client.get("/api/v1/user/export?format=csv", headers=superuser_token_headers)
+    assert response.status_code == 200
+    header = response.text.splitlines()[0].split(',')
+    assert 'email' in header
+    assert 'password' not in header
+
+
+def test_export_arrow(client, superuser_token_headers):
+    pa = pytest.importorskip("pyarrow")
+    response = client.get("/api/v1/user/export?format=arrow", headers=superuser_token_headers)
+    assert response.status_code == 200
+    table = pa.ipc.open_stream(response.content).read_all()
+    assert 'email' in table.column_names
+
+
+def test_bulk_create_update_delete(client, superuser_token_headers):
+    operations = [
+        {"op": "create", "data": {"email": "bulk1@test.com", "first_name": "Bulk"}},
+        {"op": "create", "data": {"email": "bulk2@test.com"}},
+    ]
+    response = client.post("/api/v1/user/bulk", headers=superuser_token_headers, json=operations)
+    assert response.status_code == 200
+    created = response.json()['results']
+    assert [r['status'] for r in created] == ['created', 'created']
+
+    operations = [
+        {"op": "update", "id": created[0]['id'], "data": {"first_name": "Changed"}},
+        {"op": "delete", "id": created[1]['id']},
+    ]
+    response = client.post("/api/v1/user/bulk", headers=superuser_token_headers, json=operations)
+    assert response.status_code == 200
+    assert [r['status'] for r in response.json()['results']] == ['updated', 'deleted']
+
+    response = client.get(f"/api/v1/user/{created[0]['id']}", headers=superuser_token_headers)
+    assert response.json()['first_name'] == 'Changed'
+    response = client.get(f"/api/v1/user/{created[1]['id']}", headers=superuser_token_headers)
+    assert response.status_code == 404
+
+
+def test_bulk_is_transactional(client, superuser_token_headers):
+    operations = [
+        {"op": "create", "data": {"email": "bulk3@test.com"}},
+        {"op": "delete", "id": "missing"},
+    ]
+    response = client.post("/api/v1/user/bulk", headers=superuser_token_headers, json=operations)
+    assert response.status_code == 400
+    assert response.json()['detail'][1]['error'] == 'Item not found'
+
+    response = client.get("/api/v1/user?q=email = 'bulk3@test.com'", headers=superuser_token_headers)
+    assert response.json()['total'] == 0
+
+
+def test_record_etag(client, superuser_token_headers, test_superuser):
+    url = f"/api/v1/user/{test_superuser.external_id}"
+    response = client.get(url, headers=superuser_token_headers)
+    etag = response.headers['etag']
+    assert etag.startswith('W/')
+
+    response = client.get(url, headers={**superuser_token_headers, "If-None-Match": etag})
+    assert response.status_code == 304
+
+    client.put(url, headers=superuser_token_headers, json={"last_name": "etag"})
+    response = client.get(url, headers={**superuser_token_headers, "If-None-Match": etag})
+    assert response.status_code == 200
+
+
+def test_list_etag(client, superuser_token_headers):
+    response = client.get("/api/v1/user?limit=5", headers=superuser_token_headers)
+    etag = response.headers['etag']
+
+    response = client.get("/api/v1/user?limit=5", headers={**superuser_token_headers, "If-None-Match": etag})
+    assert response.status_code == 304
+
+    response = client.get("/api/v1/user?limit=6", headers={**superuser_token_headers, "If-None-Match": etag})
+    assert response.status_code == 200
+
+
+def test_secret_fields_not_serialized(client, superuser_token_headers, test_superuser):
+    response = client.get(f"/api/v1/user/{test_superuser.external_id}", headers=superuser_token_headers)
+    assert 'password' not in response.json()
+    assert 'reset_token' not in response.json()
+
+    response = client.get("/api/v1/user", headers=superuser_token_headers)
+    assert all('password' not in row for row in response.json()['data'])
+
+
+def test_sparse_fieldsets(client, superuser_token_headers, test_superuser):
+    response = client.get("/api/v1/user?fields=email,first_name&limit=1", headers=superuser_token_headers)
+    assert response.status_code == 200
+    data = response.json()
+    assert set(data['data'][0]) == {'email', 'first_name'}
+    assert data['next_cursor']
+
+    response = client.get(f"/api/v1/user/{test_superuser.external_id}?fields=email", headers=superuser_token_headers)
+    assert response.json() == {'email': test_superuser.email}
+
+
+def test_sparse_fieldsets_invalid(client, superuser_token_headers):
+    response = client.get("/api/v1/user?fields=password", headers=superuser_token_headers)
+    assert response.status_code == 400
+    response = client.get("/api/v1/user?fields=notacolumn", headers=superuser_token_headers)
+    assert response.status_code == 400
+
+
+def test_include_relationships(client, superuser_token_headers, test_superuser):
+    from sqlalchemy import event
+    from app.db.session import test_async_engine
+
+    operations = [{"op": "create", "data": {"email": f"include{i}@test.com"}} for i in range(5)]
+    client.post("/api/v1/user/bulk", headers=superuser_token_headers, json=operations)
+
+    statements = []
+
+    def count_statement(*args):
+        statements.append(args)
+
+    event.listen(test_async_engine.sync_engine, "before_cursor_execute", count_statement)
+    try:
+        response = client.get(
+            "/api/v1/user?include=created_by,modified_by&q=email startswith 'include'", headers=superuser_token_headers
+        )
+    finally:
+        event.remove(test_async_engine.sync_engine, "before_cursor_execute", count_statement)
+    assert response.status_code == 200
+    rows = response.json()['data']
+    assert len(rows) == 5
+    assert rows[0]['created_by']['email'] == test_superuser.email
+    assert 'password' not in rows[0]['created_by']
+    # etag probe, count, page & one query per include no matter how many rows
+    assert len(statements) <= 5
+
+
+def test_include_invalid(client, superuser_token_headers):
+    response = client.get("/api/v1/user?include=password", headers=superuser_token_headers)
+    assert response.status_code == 400
+
+
+def test_list_filter_invalid(client, superuser_token_headers):
+    response = client.get("/api/v1/user?q=1=1; drop table user", headers=superuser_token_headers)
+    assert response.status_code == 400
+    response = client.get("/api/v1/user?sort=password", headers=superuser_token_headers)
+    assert response.status_code == 400
+
+
+def test_request_uses_one_connection(client, superuser_token_headers):
+    from sqlalchemy import event
+    from app.api.auth import user_cache
+    from app.db.session import test_async_engine
+
+    checkouts = []
+
+    def count_checkout(*args):
+        checkouts.append(1)
+
+    user_cache.clear()
+    event.listen(test_async_engine.sync_engine, "checkout", count_checkout)
+    try:
+        response = client.get("/api/v1/user", headers=superuser_token_headers)
+        assert response.status_code == 200
+        assert len(checkouts) == 1
+        checkouts.clear()
+        # the user is cached now and an invalid request never opens a session
+        response = client.get("/api/v1/user?sort=password", headers=superuser_token_headers)
+        assert response.status_code == 400
+        assert len(checkouts) == 0
+    finally:
+        event.remove(test_async_engine.sync_engine, "checkout", count_checkout)
+
+
+def test_list_response_cache(client, superuser_token_headers):
+    response = client.get("/api/v1/user?limit=5&sort=email", headers=superuser_token_headers)
+    assert response.status_code == 200
+    cached = client.get("/api/v1/user?limit=5&sort=email", headers=superuser_token_headers)
+    assert cached.content == response.content
+    assert cached.headers["etag"] == response.headers["etag"]
+    assert 'desc="0 queries"' in cached.headers["server-timing"]
+
+    # a write to the resource invalidates it
+    created = client.post("/api/v1/user", headers=superuser_token_headers, json={"email": "cache@test.com"})
+    assert created.status_code == 200
+    fresh = client.get("/api/v1/user?limit=5&sort=email", headers=superuser_token_headers)
+    assert 'desc="0 queries"' not in fresh.headers["server-timing"]
+    assert fresh.json()["total"] == response.json()["total"] + 1
+
+    record = client.get(f"/api/v1/user/{created.json()['external_id']}", headers=superuser_token_headers)
+    again = client.get(f"/api/v1/user/{created.json()['external_id']}", headers=superuser_token_headers)
+    assert again.content == record.content
+    assert 'desc="0 queries"' in again.headers["server-timing"]
+
+
+def test_cached_user_survives_rollback(client, superuser_token_headers):
+    from app.api.auth import user_cache
+
+    user_cache.clear()
+    operations = [
+        {"op": "create", "data": {"email": "duplicate@test.com"}},
+        {"op": "create", "data": {"email": "duplicate@test.com"}},
+    ]
+    # the duplicate email fails the insert & the request's session is rolled back after auth cached the user
+    response = client.post("/api/v1/user/bulk", headers=superuser_token_headers, json=operations)
+    assert response.status_code == 400
+    response = client.get("/api/v1/user", headers=superuser_token_headers)
+    assert response.status_code == 200
+
+
+def test_etag_covers_included_rows(client, superuser_token_headers, test_superuser):
+    created = client.post("/api/v1/user", headers=superuser_token_headers, json={"email": "etag-include@test.com"})
+    record_url = f"/api/v1/user/{created.json()['external_id']}?include=created_by"
+    list_url = "/api/v1/user?include=created_by&q=email = 'etag-include@test.com'"
+    record = client.get(record_url, headers=superuser_token_headers)
+    listed = client.get(list_url, headers=superuser_token_headers)
+
+    # renaming the creator changes what both responses include
+    client.put(
+        f"/api/v1/user/{test_superuser.external_id}", headers=superuser_token_headers, json={"first_name": "Renamed"}
+    )
+    response = client.get(record_url, headers={**superuser_token_headers, "If-None-Match": record.headers["etag"]})
+    assert response.status_code == 200
+    assert response.json()["created_by"]["first_name"] == "Renamed"
+    response = client.get(list_url, headers={**superuser_token_headers, "If-None-Match": listed.headers["etag"]})
+    assert response.status_code == 200
+    assert response.json()["data"][0]["created_by"]["first_name"] == "Renamed"
+
+
+@pytest.mark.parametrize("q", ["id startswith 1", "(" * 2000 + "id = 1" + ")" * 2000])
+def test_list_filter_rejected(client, superuser_token_headers, q):
+    response = client.get("/api/v1/user", params={"q": q}, headers=superuser_token_headers)
+    assert response.status_code == 400
+
+
+
+def test_field_order_shares_a_serializer():
+    from app.api.lib.serializers import get_serializer
+    from app.api.utils import parse_fields, parse_include
+    from app.db.registry import resources
+
+    meta = resources.get("user")
+    fields = parse_fields(meta, "id,first_name,email,id")
+    assert fields == parse_fields(meta, "email,first_name,id")
+    assert parse_include(meta, "modified_by,created_by") == parse_include(meta, "created_by,modified_by")
+    assert get_serializer(meta, fields) is get_serializer(meta, parse_fields(meta, "first_name,id,email"))
@@ -0,0 +1,84 @@
+"""
+Gets a new process to steady state before it takes traffic. The mappers & resource registry are built,
+`DB_WARM_CONNECTIONS` connections are opened on the primary & each replica and the generic routes'
+statements are run on every one, so they're compiled into the engine's cache & prepared on the connection
+before the first request needs them
+"""
+import asyncio
+import logging
+import time
+from types import SimpleNamespace
+
+from sqlalchemy.exc import DBAPIError
+
+from app.api.auth import user_query
+from app.api.utils import common_params, resolve_params
+from app.config import Scopes
+from app.db.crud import ListQuery, external_id_query, list_version_query
+from app.db.registry import resources
+from app.db.session import database, replicas
+
+logger = logging.getLogger("warmup")
+
+# own nothing, the statements only have to run to be compiled & prepared. Admins see every row so their
+# statements have a different shape
+NOBODY = SimpleNamespace(id=0, scopes=[Scopes.USER])
+ADMIN = SimpleNamespace(id=0, scopes=[Scopes.ADMIN, Scopes.USER])
+
+
+async def hot_statements():
+    """
+    The statements auth & the list and get routes run with their default params, for users & admins
+    """
+    statements = [user_query("")]
+    for meta in resources:
+        for user in (NOBODY, ADMIN):
+            query = ListQuery(meta.model, resolve_params(meta, await common_params()), user)
+            if query.strategy == "exact":
+                statements.append(query.count)
+            elif query.strategy == "estimate":
+                statements += query.estimates("postgresql")
+            statements += [
+                query.page,
+                list_version_query(meta.model, user),
+                external_id_query(meta.model, "", user),
+            ]
+    return statements
+
+
+async def warm_connection(db, statements):
+    try:
+        for statement in statements:
+            await db.execute(statement)
+        await db.rollback()
+    finally:
+        await db.close()
+
+
+async def warm_database(target, connections: int, statements) -> int:
+    """
+    Opens up to `connections` connections at once so the pool keeps them, returns how many were warmed.
+    A pool that doesn't keep connections only gets one, that still fills the compiled cache
+    """
+    size = getattr(target.async_engine.pool, "size", None)
+    count = min(connections, size()) if size else min(connections, 1)
+    sessions = [target.async_session() for _ in range(count)]
+    await asyncio.gather(*(warm_connection(db, statements) for db in sessions))
+    return count
+
+
+async def warm_up(connections: int):
+    start = time.perf_counter()
+    resources.build()
+    if connections <= 0:
+        return
+    statements = await hot_statements()
+    for target in [database(), *replicas.replicas]:
+        try:
+            warmed = await warm_database(target, connections, statements)
+        except (DBAPIError, OSError) as e:
+            # a cold pool is slower, not broken. Requests connect as usual
+            logger.warning("couldn't warm %s: %s", target.name, e)
+            continue
+        logger.info("warmed %d connections to %s", warmed, target.name)
+    logger.info("warm up took %.1fms", (time.perf_counter() - start) * 1000)
@@ -5,6 +5,18 @@ AUTH_COOKIE_ID = 'test-token'
 ACCESS_TOKEN_EXPIRE_MINUTES = 3600
 API_NAME = 'Test API'
 
+# authenticated users are cached in process so auth doesn't need a query per request. A write to a user
+# only evicts it in the worker that made it, with WEB_CONCURRENCY > 1 the others can keep authenticating a
+# disabled or re-scoped user for up to USER_CACHE_TTL. Lower it, or set USER_CACHE_SIZE=0, to shorten that
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 4096))
+USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 60))  # seconds
+
+# bcrypt runs in its own pool so logins don't block the event loop. kind is "thread" or "process"
+PASSWORD_HASH_EXECUTOR = os.environ.get('PASSWORD_HASH_EXECUTOR', 'thread')
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', os.cpu_count() or 1))
+# hashes queued or running before new logins are turned away with a 503
+PASSWORD_HASH_MAX_PENDING = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', 64))
+
 ORIGINS = ["http://localhost:3000"]
 
 class Scopes:
@@ -17,14 +29,72 @@ AUTH_SCOPES = {
     Scopes.USER: "for app users"
 }
 
+# how list endpoints count their total by default: exact, estimate or none. Models can override with __list_count__
+DEFAULT_LIST_COUNT = os.environ.get('DEFAULT_LIST_COUNT', 'exact')
+
+# only allow `q` filters on indexed columns. Models can override with __filter_indexed_only__
+FILTER_INDEXED_ONLY = os.environ.get('FILTER_INDEXED_ONLY', '').lower() == 'true'
+
+# serialized list & get responses cached until a write to the resource. Off by default, in process entries
+# are only used with one worker as a write doesn't reach the others. Set RESPONSE_CACHE_URL for more workers
+RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', 0))
+RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 60))  # seconds, bounds writes made outside the api
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', 1024 * 1024))
+# redis url to share the cache & its invalidations between processes, needs the redis package
+RESPONSE_CACHE_URL = os.environ.get('RESPONSE_CACHE_URL')
+
+# processes batch scripts spread their chunks over, 0 uses every core. `manage.py --workers` sets it
+BATCH_WORKERS = int(os.environ.get('BATCH_WORKERS', 1))
+
+# rows fetched per round trip when streaming an export
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 2000))
+
+# max operations in one bulk request
+BULK_MAX_ITEMS = int(os.environ.get('BULK_MAX_ITEMS', 10000))
+
+# serve prometheus metrics at /metrics
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+# add a Server-Timing header splitting out db, auth & serialize time. Off by default, every client sees it
+SERVER_TIMING = os.environ.get('SERVER_TIMING', 'false').lower() == 'true'
+# queries slower than this are logged with their statement shape, route & duration
+SLOW_QUERY_SECONDS = float(os.environ.get('SLOW_QUERY_SECONDS', 0.5))
+
 SENTRY_URL = os.environ.get('SENTRY_URL')
+# fraction of requests traced in sentry, 0 keeps tracing off the hot path entirely
+SENTRY_TRACES_SAMPLE_RATE = float(os.environ.get('SENTRY_TRACES_SAMPLE_RATE', 0))
 ENVIRONMENT = os.environ.get('ENVIRONMENT', 'production')
 
 
 POSTGRES_USER: str = os.getenv("POSTGRES_USER")
 POSTGRES_PASSWORD = os.getenv("POSTGRES_PASSWORD")
 POSTGRES_SERVER: str = os.getenv("POSTGRES_SERVER")
-POSTGRES_PORT: str = int(os.getenv("POSTGRES_PORT"))
+POSTGRES_PORT: str = int(os.getenv("POSTGRES_PORT", 5432))
 POSTGRES_DB: str = os.getenv("POSTGRES_DB")
 DB_CONNECTION_STR = f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_SERVER}:{POSTGRES_PORT}/{POSTGRES_DB}"
-TEST_DB_CONNECTION_STR = f"{DB_CONNECTION_STR}_testrun"
\ No newline at end of file
+TEST_DB_CONNECTION_STR = f"{DB_CONNECTION_STR}_testrun"
+ASYNC_DB_CONNECTION_STR = DB_CONNECTION_STR.replace("postgresql://", "postgresql+asyncpg://", 1)
+ASYNC_TEST_DB_CONNECTION_STR = f"{ASYNC_DB_CONNECTION_STR}_testrun"
+
+# pools are per process & per database. DB_CONNECTION_BUDGET is how many connections one host may open to each
+# database, it's split evenly between the host's WEB_CONCURRENCY workers. DB_POOL_SIZE & DB_MAX_OVERFLOW set the
+# sizes directly instead. With neither each worker pools 32 connections & opens up to 64 more under load
+WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', 1))
+DB_CONNECTION_BUDGET = int(os.environ['DB_CONNECTION_BUDGET']) if os.environ.get('DB_CONNECTION_BUDGET') else None
+DB_POOL_SIZE = int(os.environ['DB_POOL_SIZE']) if os.environ.get('DB_POOL_SIZE') else None
+DB_MAX_OVERFLOW = int(os.environ['DB_MAX_OVERFLOW']) if os.environ.get('DB_MAX_OVERFLOW') else None
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 30))  # seconds to wait for a connection
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', -1))  # seconds before a connection is replaced, -1 never
+# "transaction" when connecting through a transaction pooler like PgBouncer: connections don't keep prepared
+# statements between transactions so asyncpg's statement caches are off. DB_POOL_SIZE=0 leaves all pooling to it
+DB_POOLER_MODE = os.environ.get('DB_POOLER_MODE', 'session')
+
+# connections opened at startup, each has the generic routes' statements run on it so the first requests
+# don't pay for connecting, compiling & preparing. 0 turns warming off
+DB_WARM_CONNECTIONS = int(os.environ.get('DB_WARM_CONNECTIONS', 4))
+
+# read replicas as comma separated postgresql:// urls. list & get reads go round robin to healthy replicas
+DB_REPLICA_URLS = [url.strip() for url in os.environ.get('DB_REPLICA_URLS', '').split(',') if url.strip()]
+# a replica that can't be reached is skipped for this long
+REPLICA_RETRY_SECONDS = float(os.environ.get('REPLICA_RETRY_SECONDS', 30))
+# reads by a user, or of a model, written within this window go to the primary so replica lag isn't visible
+READ_YOUR_WRITES_SECONDS = float(os.environ.get('READ_YOUR_WRITES_SECONDS', 5))
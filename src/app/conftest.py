@@ -1,3 +1,4 @@
+import os
 import pytest
 from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
@@ -5,6 +6,10 @@ from sqlalchemy_utils import database_exists, create_database, drop_database
 from fastapi.testclient import TestClient
 import typing as t
 
+# the response cache is off by default, the tests run with one worker so the in process cache is safe
+os.environ.setdefault("RESPONSE_CACHE_SIZE", "2048")
+os.environ.setdefault("SERVER_TIMING", "true")
+
 from app import mock
 from app.api import auth, schemas
 from app.db import models
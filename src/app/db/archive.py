@@ -0,0 +1,139 @@
+"""
+Archive tables for soft deleted rows. `app/scripts/archive_deleted.py` moves rows deleted long enough ago
+out of each model's table into `archive_<table>`, so the hot tables & their indexes only hold live data.
+
+Archive tables copy the model's columns with no constraints or indexes besides the primary key, plus
+`archived_at`. They're created & given new columns by the script, not by migrations.
+
+Moving tombstones out can lower a table's latest `modified` back to a value an earlier list etag was made
+from, so every batch also bumps the table's row in `table_version`, which list etags include
+"""
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, func, inspect, select, union
+from sqlalchemy.dialects.postgresql import insert
+
+from app.db.session import Base
+
+ARCHIVE_PREFIX = "archive_"
+
+archive_metadata = MetaData()
+
+# one row per table that has had rows archived, created by migrations like the models
+table_version = Table(
+    "table_version",
+    Base.metadata,
+    Column("table_name", String(length=255), primary_key=True),
+    Column("version", Integer, nullable=False),
+)
+
+
+def is_archive_table(name: str) -> bool:
+    return name.startswith(ARCHIVE_PREFIX)
+
+
+def archive_table(table) -> Table:
+    name = f"{ARCHIVE_PREFIX}{table.name}"
+    if name in archive_metadata.tables:
+        return archive_metadata.tables[name]
+    columns = [Column(c.name, c.type, primary_key=c.primary_key) for c in table.columns]
+    return Table(name, archive_metadata, *columns, Column("archived_at", DateTime))
+
+
+def create_archive_table(connection, table) -> Table:
+    """
+    Creates the table's archive table, or adds any columns the model gained since it was created
+    """
+    archive = archive_table(table)
+    archive.create(connection, checkfirst=True)
+    existing = {c["name"] for c in inspect(connection).get_columns(archive.name)}
+    for column in archive.columns:
+        if column.name not in existing:
+            column_type = column.type.compile(dialect=connection.dialect)
+            connection.exec_driver_sql(f'ALTER TABLE "{archive.name}" ADD COLUMN "{column.name}" {column_type}')
+    return archive
+
+
+def archivable_tables(metadata):
+    """
+    Soft deleted tables, referencing tables first so their rows are gone before the rows they point at
+    """
+    return [t for t in reversed(metadata.sorted_tables) if "is_deleted" in t.c and not is_archive_table(t.name)]
+
+
+def referenced_ids(table, metadata):
+    """
+    Ids of the table's rows a foreign key points at, deleted or not, they can't be moved until the rows
+    pointing at them are. None when nothing references the table.
+
+    Some of the referencing columns aren't indexed, so this is read once per run rather than checked per batch
+    """
+    selects = []
+    for other in metadata.sorted_tables:
+        for fk in other.foreign_keys:
+            if fk.column.table is table:
+                column = other.c[fk.parent.name]
+                selects.append(select(column).where(column.isnot(None)))
+    return union(*selects) if selects else None
+
+
+def eligible(table, cutoff: datetime):
+    return [
+        table.c.is_deleted == True,
+        # deleting a record saves it, so modified is when it was deleted
+        table.c.modified < cutoff,
+    ]
+
+
+def candidates(table, cutoff: datetime, batch_size: int, after: int = 0):
+    """
+    Locks up to `batch_size` eligible ids over `after`, the caller drops the referenced ones. Rows locked by
+    a request are skipped & the caller moves past them, so they're left for the next run
+    """
+    return (
+        select(table.c.id)
+        .where(table.c.id > after, *eligible(table, cutoff))
+        .order_by(table.c.id)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    )
+
+
+def archive_rows(table, ids):
+    """
+    One statement that deletes the rows & inserts what the delete returned into the archive table, so a row
+    is always in exactly one of them. Returns the archived ids
+    """
+    archive = archive_table(table)
+    names = [c.name for c in table.columns]
+    moved = table.delete().where(table.c.id.in_(ids)).returning(*table.c).cte("moved")
+    return (
+        archive.insert()
+        .from_select(names + ["archived_at"], select(*[moved.c[n] for n in names], func.now()))
+        .add_cte(moved)
+        .returning(archive.c.id)
+    )
+
+
+def bump_version(table):
+    statement = insert(table_version).values(table_name=table.name, version=1)
+    return statement.on_conflict_do_update(
+        index_elements=[table_version.c.table_name], set_={"version": table_version.c.version + 1}
+    )
+
+
+def archived_version(*tables):
+    """
+    Sum of the tables' versions, it goes up with every archived batch. A primary key lookup so list etags
+    can include it for free
+    """
+    names = [t.name for t in tables]
+    return select(func.sum(table_version.c.version)).where(table_version.c.table_name.in_(names)).scalar_subquery()
+
+
+def count_eligible(table, metadata, cutoff: datetime):
+    filters = eligible(table, cutoff)
+    referenced = referenced_ids(table, metadata)
+    if referenced is not None:
+        filters.append(table.c.id.not_in(referenced))
+    return select(func.count()).select_from(table).where(*filters)
@@ -0,0 +1,102 @@
+"""
+Async versions of the crud functions for use with an `AsyncSession`.
+The statements are built by `app.db.crud` so both paths stay in sync
+"""
+from sqlalchemy import update
+from app.db.crud import (
+    set_audit_fields,
+    apply_updates,
+    notify_write,
+    external_id_query,
+    export_query,
+    list_version_query,
+    latest,
+    read_estimate,
+    fetch_all,
+    BulkPlan,
+    ListQuery,
+)
+
+
+async def save_resource(db, record, user_id: int):
+    record = set_audit_fields(record, user_id)
+    db.add(record)
+    await db.commit()
+    await db.refresh(record)
+    notify_write(type(record), [record])
+    return record
+
+
+async def update_resource(db, existing, updated, user_id: int):
+    existing = apply_updates(existing, updated)
+    return await save_resource(db, existing, user_id)
+
+
+async def count_records(db, query):
+    if query.strategy == "exact":
+        return (await db.execute(query.count)).scalar_one()
+    if query.strategy == "estimate":
+        for statement in query.estimates(db.get_bind().dialect.name):
+            estimate = read_estimate((await db.execute(statement)).scalar())
+            if estimate is not None:
+                return estimate
+    return None
+
+
+async def list_resource(db, resource, params, user):
+    query = ListQuery(resource, params, user)
+    total_records = await count_records(db, query)
+    results = fetch_all(await db.execute(query.page), query)
+    return query.results(results, total_records)
+
+
+async def query_by_external_id(db, resource, external_id, u, fields=None, include=None):
+    result = await db.execute(external_id_query(resource, external_id, u, fields, include))
+    return result.first() if fields and not include else result.scalars().first()
+
+
+async def list_version(db, resource, user, include=None):
+    """
+    Latest `modified` & the archived version from `list_version_query`
+    """
+    *modified, archived = (await db.execute(list_version_query(resource, user, include))).one()
+    return latest(*modified), archived
+
+
+async def stream_resource(db, resource, user, batch_size: int):
+    """
+    Yields lists of rows from a server side cursor so memory stays flat however big the table is
+    """
+    query = export_query(resource, user).execution_options(yield_per=batch_size)
+    result = await db.stream(query)
+    async for rows in result.partitions():
+        yield rows
+
+
+async def bulk_resource(db, resource, operations, user):
+    """
+    Runs a list of create/update/delete operations in one transaction, nothing is written if any item fails.
+    Returns the plan with a result per item
+    """
+    plan = BulkPlan(resource, operations, user)
+    if plan.lookup_query is not None:
+        plan.resolve(dict((await db.execute(plan.lookup_query)).all()))
+    if plan.errors:
+        return plan
+
+    created_ids = {}
+    if plan.creates:
+        created = await db.execute(plan.insert_statement, plan.creates)
+        created_ids = {external_id: id for id, external_id in created.all()}
+    if plan.updates:
+        await db.execute(update(resource), plan.update_values)
+    if plan.deletes:
+        await db.execute(plan.delete_statement)
+    await db.commit()
+    notify_write(resource, plan.written(created_ids))
+    return plan
+
+
+async def delete(db, resource, user_id: int):
+    resource.is_deleted = True
+    await save_resource(db, resource, user_id)
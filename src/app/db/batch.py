@@ -0,0 +1,150 @@
+"""
+Helpers for scripts that process whole tables, e.g. nightly backfills.
+
+    from app.db import batch
+
+    def backfill(db, start, stop):
+        rows = select(User).where(User.id >= start, User.id < stop)
+        for users in batch.iterate(db, rows, scalars=True):
+            ...
+        return count
+
+    def handle(*args):
+        with SessionManager() as db:
+            chunks = batch.id_ranges(db, User, chunk_size=50000)
+        batch.run_chunks(backfill, chunks, checkpoint=batch.Checkpoint("backfill.json"))
+
+`run_chunks` calls the function with a fresh session for each chunk & commits it when the function returns.
+With more than one worker chunks run in a process pool, `python manage.py <script> --workers 8` sets the
+default, 0 uses every core. The function has to be defined at module level so workers can import it.
+A checkpoint file records the planned chunks & the finished ones so a job that stopped carries on where it
+left off, with the same chunk boundaries even if rows were added or removed since
+"""
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from sqlalchemy import func, select
+
+from app.config import BATCH_WORKERS
+from app.db.session import SessionManager, database_engines
+
+
+def iterate(db, statement, batch_size: int = 1000, scalars: bool = False):
+    """
+    Yields lists of up to `batch_size` rows read through a server side cursor, memory stays flat however
+    many rows the statement returns
+    """
+    result = db.execute(statement.execution_options(yield_per=batch_size))
+    if scalars:
+        result = result.scalars()
+    yield from result.partitions()
+
+
+def id_ranges(db, model, chunk_size: int, *filters):
+    """
+    Splits the model's ids into [start, stop) ranges of `chunk_size` ids. Gaps in the ids make some chunks
+    smaller, none are bigger
+    """
+    low, high = db.execute(select(func.min(model.id), func.max(model.id)).where(*filters)).one()
+    if low is None:
+        return []
+    return [(start, min(start + chunk_size, high + 1)) for start in range(low, high + 1, chunk_size)]
+
+
+def worker_count(workers: int = None) -> int:
+    workers = BATCH_WORKERS if workers is None else workers
+    return workers if workers > 0 else os.cpu_count() or 1
+
+
+class Checkpoint:
+    """
+    The chunks a job planned & the ones it has finished, saved to a json file after each one
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.chunks = None
+        self.done = set()
+        if os.path.exists(path):
+            with open(path) as f:
+                saved = json.load(f)
+            self.done = {tuple(chunk) for chunk in saved["done"]}
+            if saved.get("chunks") is not None:
+                self.chunks = [tuple(chunk) for chunk in saved["chunks"]]
+
+    def __contains__(self, chunk):
+        return tuple(chunk) in self.done
+
+    def plan(self, chunks):
+        """
+        The chunks saved by the first run, or `chunks` saved for the next ones. Chunks computed again from
+        the table's live ids could cut it in different places than the finished ones
+        """
+        if self.chunks is None:
+            self.chunks = [tuple(chunk) for chunk in chunks]
+            self.save()
+        return self.chunks
+
+    def mark(self, chunk):
+        self.done.add(tuple(chunk))
+        self.save()
+
+    def save(self):
+        # written to a temporary file first so stopping mid write can't lose the finished chunks
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "w") as f:
+            json.dump({"chunks": self.chunks, "done": sorted(self.done)}, f)
+        os.replace(temporary, self.path)
+
+
+def run_chunk(fn, chunk):
+    with SessionManager() as db:
+        result = fn(db, *chunk)
+        db.commit()
+    return result
+
+
+def init_worker():
+    # forked workers inherit the parent's pools, they have to open their own connections without
+    # closing the parent's
+    for _, engine in database_engines():
+        engine.dispose(close=False)
+
+
+def run_chunks(fn, chunks, workers: int = None, checkpoint: Checkpoint = None, progress=print):
+    """
+    Calls `fn(db, *chunk)` for every chunk not already in the checkpoint, each in its own transaction.
+    A checkpoint from an earlier run replaces `chunks` with the ones that run planned. Returns the results
+    by chunk. If a chunk fails the others that are running finish, the rest are
+    cancelled & the error is raised
+    """
+    if checkpoint is not None:
+        chunks = checkpoint.plan(chunks)
+    pending = [chunk for chunk in chunks if checkpoint is None or chunk not in checkpoint]
+    workers = min(worker_count(workers), len(pending)) or 1
+    if checkpoint is not None and len(pending) < len(chunks):
+        progress(f"resuming, {len(chunks) - len(pending)} of {len(chunks)} chunks already done")
+    results = {}
+
+    def finished(chunk, result):
+        results[chunk] = result
+        if checkpoint is not None:
+            checkpoint.mark(chunk)
+        progress(f"chunk {len(results)}/{len(pending)} {chunk} done: {result}")
+
+    if workers == 1:
+        for chunk in pending:
+            finished(chunk, run_chunk(fn, chunk))
+        return results
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+        futures = {executor.submit(run_chunk, fn, chunk): chunk for chunk in pending}
+        try:
+            for future in as_completed(futures):
+                finished(futures[future], future.result())
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+    return results
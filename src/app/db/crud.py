@@ -1,8 +1,45 @@
-from sqlalchemy import func
+import json
+import uuid
+from datetime import date, datetime
+from sqlalchemy import asc, desc, func, insert, inspect, select, text, tuple_, update
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import aliased, load_only, raiseload, selectinload
+from sqlalchemy.sql.expression import ClauseElement, Executable
+from app.db.archive import archived_version
 from app.db.models import User
+from app.db.registry import resources
+from app.db.session import read_keys, replicas
 from app.config import Scopes
 
+# callbacks run with (model, records) after records are written, used to invalidate caches
+write_listeners = []
+
+
+def on_write(listener):
+    write_listeners.append(listener)
+    return listener
+
+
+def notify_write(model, records):
+    for listener in write_listeners:
+        listener(model, records)
+
+
+@on_write
+def track_replica_writes(model, records):
+    # the writer's reads & reads of this model go to the primary until the replicas have caught up
+    records = [r if isinstance(r, dict) else vars(r) for r in records]
+    keys = read_keys(model=model)
+    for writer in {r.get("modified_by_id") for r in records}:
+        keys += read_keys(user_id=writer)
+    replicas.mark_written(*keys)
+
+
 def set_audit_fields(record, user_id):
+    if isinstance(record, dict):
+        record["created_by_id"] = record.get("created_by_id") or user_id
+        record["modified_by_id"] = user_id
+        return record
     record.created_by_id = record.created_by_id if record.created_by_id else user_id
     record.modified_by_id = user_id
     return record
@@ -17,97 +54,413 @@ def save_resource(db, record, user_id: int):
     db.add(record)
     db.commit()
     db.refresh(record)
+    notify_write(type(record), [record])
     return record
 
 
-def update_resource(db, existing, updated, user_id: int):
-    for var, value in updated.items():
+def apply_updates(existing, updated: dict):
+    """
+    Sets the writable fields of `updated` on the record, read only fields like id & audit fields are ignored
+    """
+    for var, value in resources.for_model(type(existing)).writable(updated).items():
         setattr(existing, var, value)
+    return existing
+
+
+def update_resource(db, existing, updated, user_id: int):
+    existing = apply_updates(existing, updated)
     return save_resource(db, existing, user_id)
 
 
 def save_resource_bulk(db, resource, data, user_id: int):
+    meta = resources.for_model(resource)
     d = []
     for row in data:
         row = set_audit_fields(row, user_id)
-        d.append(row.__dict__)
+        unloaded = inspect(row).unloaded
+        d.append({c: getattr(row, c) for c in meta.column_names if c not in unloaded})
     db.bulk_update_mappings(resource, d)
     db.commit()
+    notify_write(resource, data)
 
 
-def list_resource(db, resource, params, user):
-    limit = params["limit"]
-    offset = params["page"]
-    sort_by = params["sort_by"]
-    query_filter = params["q"]
+BULK_OPERATIONS = ("create", "update", "delete")
+
+
+class BulkPlan:
+    """
+    Sorts a list of bulk operations into batched creates, updates & deletes and keeps a result per item.
+
+    Each operation looks like {"op": "create", "data": {...}}, {"op": "update", "id": external_id, "data": {...}}
+    or {"op": "delete", "id": external_id}
+    """
+
+    def __init__(self, resource, operations, user):
+        self.resource = resource
+        self.meta = resources.for_model(resource)
+        self.user = user
+        self.results = []
+        self.creates = []
+        self.updates = []
+        self.deletes = []
+        self.ids = {}
+        for index, item in enumerate(operations):
+            op = item.get("op") if isinstance(item, dict) else None
+            data = item.get("data", {}) if isinstance(item, dict) else None
+            result = {"index": index, "op": op}
+            self.results.append(result)
+            if op not in BULK_OPERATIONS or not isinstance(data, dict):
+                result["error"] = "Invalid operation"
+            elif op == "create":
+                values = set_audit_fields(self.meta.writable(data), user.id)
+                values["external_id"] = result["id"] = str(uuid.uuid4())
+                self.creates.append(values)
+            elif not item.get("id"):
+                result["error"] = "Missing id"
+            else:
+                result["id"] = item["id"]
+                if op == "update":
+                    self.updates.append((result, self.meta.writable(data)))
+                else:
+                    self.deletes.append(result)
+
+    @property
+    def errors(self):
+        return [r for r in self.results if "error" in r]
+
+    @property
+    def lookup_query(self):
+        """
+        Maps the external ids being updated or deleted to ids, only for records the user can see
+        """
+        references = {r["id"] for r, _ in self.updates} | {r["id"] for r in self.deletes}
+        if not references:
+            return None
+        return (
+            select(self.resource.external_id, self.resource.id)
+            .where(*owner_filters(self.resource, self.user))
+            .filter_by(is_deleted=False)
+            .where(self.resource.external_id.in_(references))
+        )
+
+    def resolve(self, ids: dict):
+        self.ids = ids
+        for result in [r for r, _ in self.updates] + self.deletes:
+            if result["id"] not in ids:
+                result["error"] = "Item not found"
+
+    @property
+    def insert_statement(self):
+        return insert(self.resource).returning(self.resource.id, self.resource.external_id)
+
+    @property
+    def update_values(self):
+        # grouped by the orm into one executemany per set of keys
+        return [
+            {"id": self.ids[result["id"]], **values, "modified_by_id": self.user.id}
+            for result, values in self.updates
+        ]
+
+    @property
+    def delete_statement(self):
+        return (
+            update(self.resource)
+            .where(self.resource.id.in_([self.ids[r["id"]] for r in self.deletes]))
+            .values(is_deleted=True, modified_by_id=self.user.id)
+            .execution_options(synchronize_session=False)
+        )
+
+    def written(self, created_ids: dict):
+        """
+        Marks every item as done & returns the written rows as mappings for the write listeners
+        """
+        for result in self.results:
+            result["status"] = {"create": "created", "update": "updated", "delete": "deleted"}[result["op"]]
+        records = [{**values, "id": created_ids.get(values["external_id"])} for values in self.creates]
+        records += self.update_values
+        records += [
+            {"id": self.ids[r["id"]], "external_id": r["id"], "modified_by_id": self.user.id}
+            for r in self.deletes
+        ]
+        return records
+
+
+def owner_filters(resource, user):
+    """
+    Admins can see every record, users can only see the records they created
+    """
     if Scopes.ADMIN in user.scopes:
-        if query_filter is not None:
-            total_records = db.query(resource.id).filter(query_filter).count()
-            return (
-                db.query(resource)
-                .filter(query_filter)
-                .filter_by(is_deleted=False)
-                .order_by(sort_by)
-                .offset(offset)
-                .limit(limit)
-                .all()
-            ), total_records
-        else:
-            total_records = db.query(resource.id).count()
-            return (
-                db.query(resource)
-                .filter_by(is_deleted=False)
-                .order_by(sort_by)
-                .offset(offset)
-                .limit(limit)
-                .all()
-            ), total_records
+        return []
+    return [resource.created_by_id == user.id]
+
+
+def cursor_value(column, value):
+    """
+    Converts a value decoded from a cursor back to the column's python type
+    """
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        return value
+    if python_type in (datetime, date) and isinstance(value, str):
+        return python_type.fromisoformat(value)
+    return value
+
+
+def keyset_pagination(resource, params):
+    """
+    Ordering with the id as a tiebreaker & the seek filter for a cursor. When sorting by an indexed column,
+    seeking past the last row instead of offsetting means deep pages cost the same as the first
+    """
+    meta = resources.for_model(resource)
+    sort_col = getattr(resource, params["sort"])
+    id_col = getattr(resource, meta.primary_key)
+    direction = desc if params["sort_dir"] == "desc" else asc
+    order_by = [direction(sort_col)]
+    if params["sort"] != meta.primary_key:
+        order_by.append(direction(id_col))
+
+    after = params.get("after")
+    if after is None:
+        return order_by, None
+    value = cursor_value(sort_col, after["value"])
+    if params["sort"] == meta.primary_key:
+        key, last_key = sort_col, value
     else:
-        if query_filter is not None:
-            total_records = db.query(resource.id).filter(query_filter).filter_by(created_by_id=user.id).count()
-            return (
-                db.query(resource)
-                .filter(query_filter)
-                .filter_by(is_deleted=False)
-                .filter_by(created_by_id=user.id)
-                .order_by(sort_by)
-                .offset(offset)
-                .limit(limit)
-                .all()
-            ), total_records
+        key, last_key = tuple_(sort_col, id_col), tuple_(value, after["id"])
+    seek = key < last_key if params["sort_dir"] == "desc" else key > last_key
+    return order_by, seek
+
+
+def is_keyset_sort(resource, params):
+    meta = resources.for_model(resource)
+    return params.get("sort") in meta.sortable_columns and params.get("sort_dir") in ("asc", "desc")
+
+
+class explain(Executable, ClauseElement):
+    """
+    EXPLAIN (FORMAT JSON) for a select, used to read the planner's row estimate
+    """
+    inherit_cache = False
+
+    def __init__(self, statement):
+        self.statement = statement
+
+
+@compiles(explain, "postgresql")
+def _compile_explain(element, compiler, **kw):
+    return "EXPLAIN (FORMAT JSON) " + compiler.process(element.statement, **kw)
+
+
+def read_estimate(value):
+    """
+    Row estimate from either an EXPLAIN plan or pg_class.reltuples. None if postgres doesn't have one yet
+    """
+    if isinstance(value, str):
+        value = json.loads(value)
+    if isinstance(value, list):
+        return int(value[0]["Plan"]["Plan Rows"])
+    if value is None or value < 0:
+        return None
+    return int(value)
+
+
+def projection(resource, fields, *required, include=None):
+    """
+    Columns to select for a sparse fieldset, plus any the api needs itself. Selecting plain columns
+    means unused ones are never fetched and no orm objects are built.
+    Included relationships need orm objects, so those select the model & narrow it with `load_options`
+    """
+    if not fields or include:
+        return [resource]
+    return [getattr(resource, c) for c in dict.fromkeys((*fields, *required))]
+
+
+def load_options(resource, fields=None, *required, include=None):
+    """
+    Only the included relationships are loaded, with one query each & just their include fields.
+    Touching any other relationship raises rather than lazy loading a query per row
+    """
+    meta = resources.for_model(resource)
+    options = []
+    if fields:
+        columns = [getattr(resource, c) for c in dict.fromkeys((*fields, *required))]
+        options.append(load_only(*columns, raiseload=True))
+    for name in include or ():
+        related = resources.for_model(meta.relationships[name])
+        # modified is loaded too, the record's etag covers the included rows
+        names = (*related.include_fields, "modified") if "modified" in related.columns else related.include_fields
+        columns = [getattr(related.model, c) for c in dict.fromkeys(names)]
+        options.append(
+            selectinload(getattr(resource, name)).options(load_only(*columns, raiseload=True), raiseload("*"))
+        )
+    options.append(raiseload("*"))
+    return options
+
+
+def fetch_all(result, query):
+    return result.all() if query.projected else result.scalars().all()
+
+
+class ListQuery:
+    """
+    Builds the statements for a list call so the sync and async crud run the same sql.
+
+    The total is counted according to `count`:
+    - exact: count(*) over the same rows the page is filtered on
+    - estimate: the planner's estimate, or pg_class.reltuples when nothing filters the table
+    - none: no total, fetch one extra row to tell if there's another page
+    """
+
+    def __init__(self, resource, params, user):
+        self.resource = resource
+        self.limit = params["limit"]
+        self.strategy = params.get("count") or resources.for_model(resource).count_strategy
+
+        filters = owner_filters(resource, user)
+        if params["q"] is not None:
+            filters.append(params["q"])
+        self.unfiltered = not filters
+        filters.append(resource.is_deleted == False)
+        self.filters = filters
+
+        meta = resources.for_model(resource)
+        keyset = is_keyset_sort(resource, params)
+        required = (meta.primary_key, params["sort"]) if keyset else (meta.primary_key,)
+        fields, include = params.get("fields"), params.get("include")
+        self.projected = bool(fields) and not include
+        page = select(*projection(resource, fields, *required, include=include)).where(*filters)
+        if not self.projected:
+            page = page.options(*load_options(resource, fields, *required, include=include))
+        # the api only accepts a cursor when sorting on an indexed column, other sorts page with an offset
+        order_by, seek = keyset_pagination(resource, params)
+        page = page.order_by(*order_by)
+        if seek is not None:
+            page = page.where(seek)
         else:
-            total_records = db.query(resource.id).filter_by(created_by_id=user.id).count()
-            return (
-                db.query(resource)
-                .filter_by(is_deleted=False)
-                .filter_by(created_by_id=user.id)
-                .order_by(sort_by)
-                .offset(offset)
-                .limit(limit)
-                .all()
-            ), total_records
+            page = page.offset(params["page"])
+        self.page = page.limit(self.limit + 1 if self.strategy == "none" else self.limit)
+
+    @property
+    def count(self):
+        return select(func.count(self.resource.id)).where(*self.filters)
+
+    def estimates(self, dialect: str):
+        """
+        Statements to try in order for an estimated total, falls back to an exact count outside of postgres
+        """
+        if dialect != "postgresql":
+            return [self.count]
+        statements = []
+        if self.unfiltered:
+            statements.append(
+                select(text("reltuples")).select_from(text("pg_class")).where(
+                    text("oid = to_regclass(:table)").bindparams(table=self.resource.__table__.name)
+                )
+            )
+        statements.append(explain(select(self.resource.id).where(*self.filters)))
+        return statements
+
+    def results(self, rows, total):
+        """
+        Returns the page, total & whether there are more records
+        """
+        has_more = None
+        if self.strategy == "none":
+            has_more = len(rows) > self.limit
+            rows = rows[:self.limit]
+        return rows, total, has_more
+
+
+def external_id_query(resource, external_id, u, fields=None, include=None):
+    query = select(*projection(resource, fields, "id", "modified", include=include))
+    if not fields or include:
+        query = query.options(*load_options(resource, fields, "id", "modified", include=include))
+    return (
+        query
+        .where(*owner_filters(resource, u))
+        .filter_by(external_id=external_id)
+        .filter_by(is_deleted=False)
+        .limit(1)
+    )
+
+
+def count_records(db, query):
+    if query.strategy == "exact":
+        return db.execute(query.count).scalar_one()
+    if query.strategy == "estimate":
+        for statement in query.estimates(db.get_bind().dialect.name):
+            estimate = read_estimate(db.execute(statement).scalar())
+            if estimate is not None:
+                return estimate
+    return None
+
+
+def list_version_query(resource, user, include=None):
+    """
+    Latest `modified` of every record the user can see, deleted ones included so deletes change it too, then
+    a column per relationship in `include` with the latest `modified` of the rows it points at, and last the
+    archived version of the tables they're all in
+    """
+    filters = owner_filters(resource, user)
+    columns = [select(func.max(resource.modified)).where(*filters).scalar_subquery()]
+    tables = [resource.__table__]
+    for name in include or ():
+        relationship = inspect(resource).relationships[name]
+        related = aliased(relationship.mapper.class_)
+        tables.append(relationship.mapper.local_table)
+        for local, remote in relationship.local_remote_pairs:
+            referenced = select(local).where(*filters)
+            columns.append(
+                select(func.max(related.modified)).where(getattr(related, remote.key).in_(referenced)).scalar_subquery()
+            )
+    return select(*columns, archived_version(*tables))
+
+
+def latest(*values):
+    present = [v for v in values if v is not None]
+    return max(present) if present else None
+
+
+def included_modified(record, include):
+    """
+    Latest `modified` of the rows included with a record
+    """
+    values = []
+    for name in include or ():
+        related = getattr(record, name)
+        for row in related if isinstance(related, (list, set, tuple)) else [related]:
+            if row is not None:
+                values.append(row.modified)
+    return latest(*values)
+
+
+def export_query(resource, user):
+    """
+    Selects the public columns of every record the user can see, as plain rows rather than orm objects
+    """
+    meta = resources.for_model(resource)
+    return (
+        select(*[getattr(resource, c) for c in meta.public_columns])
+        .where(*owner_filters(resource, user))
+        .filter_by(is_deleted=False)
+        .order_by(getattr(resource, meta.primary_key))
+    )
+
+
+def list_resource(db, resource, params, user):
+    query = ListQuery(resource, params, user)
+    total_records = count_records(db, query)
+    return query.results(fetch_all(db.execute(query.page), query), total_records)
 
 
 def list_resource_all(db, resource):
     return db.query(resource).filter_by(is_deleted=False).order_by(resource.id.desc()).all()
 
 
-def query_by_external_id(db, resource, external_id, u):
-    if Scopes.ADMIN in u.scopes:
-        return (
-            db.query(resource)
-            .filter_by(external_id=external_id)
-            .filter_by(is_deleted=False)
-            .first()
-        )
-    else:
-        return (
-            db.query(resource)
-            .filter_by(external_id=external_id)
-            .filter_by(is_deleted=False)
-            .filter_by(created_by_id=u.id)
-            .first()
-        )   
+def query_by_external_id(db, resource, external_id, u, fields=None, include=None):
+    result = db.execute(external_id_query(resource, external_id, u, fields, include))
+    return result.first() if fields and not include else result.scalars().first()
 
 
 def delete(db, resource, user_id: int):
@@ -8,12 +8,14 @@ from sqlalchemy import (
 
 
 class User(Base):
+    __include_fields__ = ("id", "external_id", "email", "first_name", "last_name")
+
     email = Column(String(length=255), unique=True, nullable=False)
     first_name = Column(String(length=255))
     last_name = Column(String(length=255))
-    password = Column(String(length=255))
+    password = Column(String(length=255), info={"secret": True})
     is_disabled = Column(Boolean, default=False)
-    reset_token = Column(String(length=255))
+    reset_token = Column(String(length=255), info={"secret": True})
     scopes = Column(String(length=255))
     last_login = Column(DateTime)
 
@@ -0,0 +1,101 @@
+from sqlalchemy import inspect
+from sqlalchemy.orm import configure_mappers
+
+import app.db.models  # noqa: F401 - registers the models on Base
+from app.db.session import Base
+from app.config import DEFAULT_LIST_COUNT, FILTER_INDEXED_ONLY
+
+# fields the api manages, clients can't set these directly
+READ_ONLY_FIELDS = {
+    "id",
+    "created",
+    "modified",
+    "created_by_id",
+    "modified_by_id",
+    "external_id",
+    "is_deleted",
+}
+
+
+class ModelMeta:
+    """
+    Schema information for a model, computed once so requests don't have to reflect on the model
+    """
+
+    def __init__(self, model):
+        mapper = inspect(model)
+        table = mapper.local_table
+        self.model = model
+        self.name = table.name
+        self.columns = {attr.key: attr.columns[0] for attr in mapper.column_attrs}
+        self.column_names = list(self.columns)
+        # columns flagged with info={"secret": True} are never sent to clients
+        self.secret_fields = frozenset(k for k, c in self.columns.items() if c.info.get("secret"))
+        self.public_columns = [c for c in self.column_names if c not in self.secret_fields]
+        self.primary_key = mapper.primary_key[0].key
+        self.external_key = "external_id" if "external_id" in self.columns else self.primary_key
+        self.indexed_columns = self._indexed_columns(table)
+        self.sortable_columns = [c for c in self.column_names if c in self.indexed_columns]
+        self.writable_fields = frozenset(c for c in self.column_names if c not in READ_ONLY_FIELDS)
+        self.relationships = {rel.key: rel.mapper.class_ for rel in mapper.relationships}
+        # the columns sent when another model includes this one, models can narrow it with __include_fields__
+        self.include_fields = tuple(
+            getattr(model, "__include_fields__", None) or (self.primary_key, self.external_key)
+        )
+        # large tables can set __filter_indexed_only__ so clients can only filter on indexed columns
+        self.filter_indexed_only = getattr(model, "__filter_indexed_only__", FILTER_INDEXED_ONLY)
+        # models can set __list_count__ to "exact", "estimate" or "none" to pick how list totals are counted
+        self.count_strategy = getattr(model, "__list_count__", None) or DEFAULT_LIST_COUNT
+
+    def _indexed_columns(self, table):
+        # a column can use an index if it leads one: single column indexes, unique & primary keys
+        leading = {c.name for c in list(table.primary_key.columns)[:1]}
+        leading.update(c.name for c in table.columns if c.index or c.unique)
+        for index in table.indexes:
+            expressions = list(index.expressions)
+            if expressions and hasattr(expressions[0], "name"):
+                leading.add(expressions[0].name)
+        return frozenset(key for key, column in self.columns.items() if column.name in leading)
+
+    def writable(self, data: dict) -> dict:
+        """
+        Drops any fields that aren't writable columns on the model
+        """
+        return {k: v for k, v in data.items() if k in self.writable_fields}
+
+
+class ResourceRegistry:
+    """
+    Maps url resource names to models. Built once at startup from the mappers on `Base`
+    """
+
+    def __init__(self, base):
+        self.base = base
+        self._by_name = None
+        self._by_model = None
+
+    def build(self):
+        configure_mappers()
+        metas = [ModelMeta(mapper.class_) for mapper in self.base.registry.mappers]
+        self._by_model = {meta.model: meta for meta in metas}
+        self._by_name = {meta.name: meta for meta in metas}
+        return self
+
+    def _ensure_built(self):
+        if self._by_name is None:
+            self.build()
+
+    def get(self, resource: str) -> ModelMeta:
+        self._ensure_built()
+        return self._by_name.get(resource.lower())
+
+    def for_model(self, model) -> ModelMeta:
+        self._ensure_built()
+        return self._by_model[model]
+
+    def __iter__(self):
+        self._ensure_built()
+        return iter(self._by_name.values())
+
+
+resources = ResourceRegistry(Base)
@@ -1,36 +1,285 @@
+import itertools
 import os
-from contextlib import contextmanager
-from sqlalchemy import create_engine, Column, Integer, DateTime, String, Boolean, ForeignKey
+import time
+from contextlib import contextmanager, asynccontextmanager
+from functools import cached_property
+from sqlalchemy import create_engine, make_url, Column, Integer, DateTime, String, Boolean, ForeignKey, Index, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base, declared_attr
 from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.pool import NullPool
 from datetime import datetime
 import uuid
-from app.config import DB_CONNECTION_STR, TEST_DB_CONNECTION_STR
+from app.api.lib.cache import TTLCache
+from app.api.lib.metrics import observe_checkout_wait
+from app.config import (
+    DB_CONNECTION_STR,
+    TEST_DB_CONNECTION_STR,
+    ASYNC_DB_CONNECTION_STR,
+    ASYNC_TEST_DB_CONNECTION_STR,
+    DB_REPLICA_URLS,
+    REPLICA_RETRY_SECONDS,
+    READ_YOUR_WRITES_SECONDS,
+    WEB_CONCURRENCY,
+    DB_CONNECTION_BUDGET,
+    DB_POOL_SIZE,
+    DB_MAX_OVERFLOW,
+    DB_POOL_TIMEOUT,
+    DB_POOL_RECYCLE,
+    DB_POOLER_MODE,
+)
+
+
+def pool_options(
+    pool_size: int = None,
+    max_overflow: int = None,
+    budget: int = None,
+    workers: int = 1,
+    timeout: float = 30,
+    recycle: int = -1,
+    pooler_mode: str = "session",
+):
+    """
+    Engine options for one process's pool. Explicit sizes win, otherwise a `budget` of connections per host is
+    split between its `workers` with no overflow so the host can never go over it.
+    Returns the options for the sync & the async engine
+    """
+    if pool_size is None and budget is not None:
+        max_overflow = max_overflow or 0
+        pool_size = max(1, budget // max(1, workers) - max_overflow)
+    if pool_size is None:
+        pool_size = 32
+    if max_overflow is None:
+        max_overflow = 64
 
+    if pooler_mode == "transaction" and pool_size == 0:
+        options = {"poolclass": NullPool}
+    else:
+        options = {
+            "pool_pre_ping": True,
+            "pool_size": pool_size,
+            "max_overflow": max_overflow,
+            "pool_timeout": timeout,
+            "pool_recycle": recycle,
+        }
+    async_options = dict(options)
+    if pooler_mode == "transaction":
+        # a prepared statement only lives on the server connection it was made on, which the pooler
+        # hands to someone else after the transaction. Needs PgBouncer 1.21+ for the unnamed ones asyncpg still uses
+        async_options["connect_args"] = {"statement_cache_size": 0, "prepared_statement_cache_size": 0}
+    return options, async_options
 
-engine = create_engine(
-    DB_CONNECTION_STR, pool_pre_ping=True, pool_size=32, max_overflow=64
+
+POOL_OPTIONS, ASYNC_POOL_OPTIONS = pool_options(
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    budget=DB_CONNECTION_BUDGET,
+    workers=WEB_CONCURRENCY,
+    timeout=DB_POOL_TIMEOUT,
+    recycle=DB_POOL_RECYCLE,
+    pooler_mode=DB_POOLER_MODE,
 )
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-test_engine = create_engine(TEST_DB_CONNECTION_STR)
-TestingSessionLocal = sessionmaker(
-    autocommit=False, autoflush=False, bind=test_engine
+# called with (name, engine) for every engine as it's created, async engines pass their sync_engine
+engine_listeners = []
+
+
+def on_engine(listener):
+    """
+    Registers a listener for engines created from now on & calls it for those already created
+    """
+    engine_listeners.append(listener)
+    for name, created in database_engines():
+        listener(name, created)
+    return listener
+
+
+class Database:
+    """
+    A database's sync & async engines and their session factories. Each is created on first use so
+    importing the app doesn't connect or load a driver it won't need, scripts never build the async
+    engine & the api never builds the sync one
+    """
+
+    def __init__(self, name: str, url: str, async_url: str = None, options: dict = None, async_options: dict = None):
+        self.name = name
+        self.url = url
+        self.async_url = async_url or url.replace("postgresql://", "postgresql+asyncpg://", 1)
+        self.options = options if options is not None else POOL_OPTIONS
+        self.async_options = async_options if async_options is not None else ASYNC_POOL_OPTIONS
+
+    @cached_property
+    def engine(self):
+        created = create_engine(self.url, **self.options)
+        for listener in engine_listeners:
+            listener(self.name, created)
+        return created
+
+    @cached_property
+    def session(self):
+        return sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+
+    @cached_property
+    def async_engine(self):
+        created = create_async_engine(self.async_url, **self.async_options)
+        for listener in engine_listeners:
+            listener(f"{self.name}_async", created.sync_engine)
+        return created
+
+    @cached_property
+    def async_session(self):
+        # expire_on_commit is off because attributes can't be lazy loaded from an async session after commit
+        return async_sessionmaker(bind=self.async_engine, autoflush=False, expire_on_commit=False)
+
+    def engines(self):
+        """
+        The engines created so far by name
+        """
+        if "engine" in self.__dict__:
+            yield self.name, self.engine
+        if "async_engine" in self.__dict__:
+            yield f"{self.name}_async", self.async_engine.sync_engine
+
+
+databases = {
+    "primary": Database("primary", DB_CONNECTION_STR, ASYNC_DB_CONNECTION_STR),
+    # the test client runs every request in a new event loop, so asyncpg connections can't be pooled across requests
+    "test": Database("test", TEST_DB_CONNECTION_STR, ASYNC_TEST_DB_CONNECTION_STR, {}, {"poolclass": NullPool}),
+}
+
+
+def database() -> Database:
+    """
+    The database for this environment, the test database when TEST_RUN is set
+    """
+    return databases["test" if os.environ.get("TEST_RUN") else "primary"]
+
+
+class Replica(Database):
+    def __init__(self, url: str):
+        super().__init__(f"replica_{make_url(url).host}", url)
+
+
+# the engines & session factories used to be created at import, they're still importable by their old names
+_LAZY_ATTRIBUTES = {
+    "engine": ("primary", "engine"),
+    "SessionLocal": ("primary", "session"),
+    "async_engine": ("primary", "async_engine"),
+    "AsyncSessionLocal": ("primary", "async_session"),
+    "test_engine": ("test", "engine"),
+    "TestingSessionLocal": ("test", "session"),
+    "test_async_engine": ("test", "async_engine"),
+    "TestingAsyncSessionLocal": ("test", "async_session"),
+}
+
+
+def __getattr__(name):
+    if name in _LAZY_ATTRIBUTES:
+        database_name, attribute = _LAZY_ATTRIBUTES[name]
+        return getattr(databases[database_name], attribute)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def database_engines():
+    """
+    Every engine created so far by name, async engines as their sync_engine so events & pool stats can be read
+    """
+    for db in databases.values():
+        yield from db.engines()
+    for replica in replicas.replicas:
+        yield from replica.engines()
+
+
+class ReplicaSet:
+    """
+    Picks a read replica round robin, skipping any that failed to connect in the last `retry_seconds`.
+    Reads for a key (a user or a model) written in the last `consistency_seconds` get no replica so
+    they see their own writes. Writes are only tracked in this process
+    """
+
+    def __init__(self, replicas, retry_seconds: float, consistency_seconds: float, timer=time.monotonic):
+        self.replicas = list(replicas)
+        self.retry_seconds = retry_seconds
+        self.timer = timer
+        self._down_until = {}
+        self._turn = itertools.count()
+        self._writes = TTLCache(maxsize=100000, ttl=consistency_seconds, timer=timer)
+
+    def written_recently(self, *keys) -> bool:
+        return any(self._writes.get(key) for key in keys if key[1] is not None)
+
+    def choose(self, *keys):
+        """
+        Returns the replica to read from, or None to read from the primary
+        """
+        if not self.replicas or self.written_recently(*keys):
+            return None
+        now = self.timer()
+        healthy = [r for r in self.replicas if self._down_until.get(r.url, 0) <= now]
+        if not healthy:
+            return None
+        return healthy[next(self._turn) % len(healthy)]
+
+    def mark_down(self, replica):
+        self._down_until[replica.url] = self.timer() + self.retry_seconds
+
+    def mark_written(self, *keys):
+        for key in keys:
+            if key[1] is not None:
+                self._writes.set(key, True)
+
+
+replicas = ReplicaSet(
+    [Replica(url) for url in DB_REPLICA_URLS],
+    retry_seconds=REPLICA_RETRY_SECONDS,
+    consistency_seconds=READ_YOUR_WRITES_SECONDS,
 )
 
 
+def read_keys(user_id=None, model=None):
+    return ("user", user_id), ("model", model.__tablename__ if model is not None else None)
+
+
+def standard_indexes(table_name: str):
+    """
+    The indexes every model needs for the generic routes: owner scoped lists, external id lookups & etags.
+    A model that sets its own __table_args__ should include these, `app/scripts/check_indexes.py` reports any that don't
+    """
+    live = text("NOT is_deleted")
+    return (
+        Index(f"ix_{table_name}_owner_live", "created_by_id", text("id DESC"), postgresql_where=live),
+        Index(f"ux_{table_name}_external_id_live", "external_id", unique=True, postgresql_where=live),
+        Index(f"ix_{table_name}_modified", "modified"),
+        # not partial, list etags take the latest modified of the owner's deleted rows too
+        Index(f"ix_{table_name}_owner_modified", "created_by_id", "modified"),
+    )
+
+
+def missing_indexes(table):
+    """
+    Names of the standard indexes a table doesn't declare
+    """
+    declared = {index.name for index in table.indexes}
+    return [index.name for index in standard_indexes(table.name) if index.name not in declared]
+
+
 class Base(object):
     @declared_attr
     def __tablename__(cls):
         return cls.__name__.lower()
 
+    @declared_attr
+    def __table_args__(cls):
+        return standard_indexes(cls.__tablename__)
+
     id = Column(Integer, primary_key=True, index=True)
     created = Column(DateTime, default=datetime.utcnow, nullable=False)
     modified = Column(
         DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False
     )
     modified_by_id = Column(Integer, nullable=False)
-    external_id = Column(String(length=255), index=True, default=uuid.uuid4)
+    external_id = Column(String(length=255), default=lambda: str(uuid.uuid4()))
     is_deleted = Column(Boolean, default=False)
     __name__: str
     
@@ -40,7 +289,9 @@ class Base(object):
 
     @declared_attr
     def created_by(cls):
-        return relationship('User', primaryjoin='User.id==%s.created_by_id' % cls.__name__)
+        return relationship(
+            'User', primaryjoin='User.id==%s.created_by_id' % cls.__name__, remote_side='User.id'
+        )
 
     @declared_attr
     def modified_by_id(cls):
@@ -48,20 +299,119 @@ class Base(object):
 
     @declared_attr
     def modified_by(cls):
-        return relationship('User', primaryjoin='User.id==%s.modified_by_id' % cls.__name__)
+        return relationship(
+            'User', primaryjoin='User.id==%s.modified_by_id' % cls.__name__, remote_side='User.id'
+        )
 
-    def as_dict(self):
-        return {c.name: getattr(self, c.name) for c in self.__table__.columns}
+    def as_dict(self, fields=None):
+        columns = fields or [c.name for c in self.__table__.columns]
+        return {c: getattr(self, c) for c in columns}
 
 
 Base = declarative_base(cls=Base)
 
 
+def read_replica(read_only: bool, user_id, model):
+    if not read_only or os.environ.get("TEST_RUN"):
+        return None
+    return replicas.choose(*read_keys(user_id, model))
+
+
 @contextmanager
-def SessionManager():
-    is_test = os.environ.get("TEST_RUN")
-    db = TestingSessionLocal() if is_test else SessionLocal()
+def SessionManager(read_only: bool = False, user_id=None, model=None):
+    """
+    Sessions use the primary unless `read_only` is set, then they can use a replica.
+    Pass the reading user or the model being read so recent writes are read from the primary
+    """
+    db = replica_session(read_replica(read_only, user_id, model))
+    if db is None:
+        db = database().session()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def open_async_session(read_only: bool = False, user_id=None, model=None):
+    """
+    Returns a new session & whether it's on a replica
+    """
+    db = await async_replica_session(read_replica(read_only, user_id, model))
+    if db is not None:
+        return db, True
+    return database().async_session(), False
+
+
+@asynccontextmanager
+async def AsyncSessionManager(read_only: bool = False, user_id=None, model=None):
+    db, _ = await open_async_session(read_only, user_id, model)
     try:
         yield db
     finally:
+        await db.close()
+
+
+class RequestSession:
+    """
+    The one AsyncSession a request uses, shared by auth & the handler so a request checks out a single
+    connection. It's opened on first use so requests answered from cache never check one out.
+
+    `read_only` requests can be served by a replica. If a later caller needs the primary to see its own
+    writes the replica session is closed before the primary one is opened, so there's never two at once
+    """
+
+    def __init__(self, read_only: bool):
+        self.read_only = read_only
+        self.on_replica = False
+        self._db = None
+
+    async def get(self, user_id=None, model=None):
+        keys = read_keys(user_id, model)
+        if self._db is not None and self.on_replica and replicas.written_recently(*keys):
+            await self.close()
+        if self._db is None:
+            self._db, self.on_replica = await open_async_session(self.read_only, user_id, model)
+            if not self.on_replica:
+                await connect(self._db)
+        return self._db
+
+    async def close(self):
+        if self._db is not None:
+            await self._db.close()
+            self._db = None
+            self.on_replica = False
+
+
+def replica_session(replica):
+    # connect up front so an unreachable replica falls back to the primary instead of failing the request
+    if replica is None:
+        return None
+    db = replica.session()
+    try:
+        db.connection()
+    except (DBAPIError, OSError):
         db.close()
+        replicas.mark_down(replica)
+        return None
+    return db
+
+
+async def connect(db):
+    # connecting up front times the checkout, when the pool is at its limit that's the time spent queued
+    start = time.perf_counter()
+    await db.connection()
+    observe_checkout_wait(db.bind.sync_engine, time.perf_counter() - start)
+    return db
+
+
+async def async_replica_session(replica):
+    if replica is None:
+        return None
+    db = replica.async_session()
+    try:
+        await connect(db)
+    except (DBAPIError, OSError):
+        await db.close()
+        replicas.mark_down(replica)
+        return None
+    return db
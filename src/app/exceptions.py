@@ -27,3 +27,8 @@ class Codes:
         detail="Invalid request",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    SERVER_BUSY = HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Server busy, try again shortly",
+        headers={"Retry-After": "1"},
+    )
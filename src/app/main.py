@@ -1,14 +1,20 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 
-from starlette.requests import Request
 import uvicorn
 
 from app.api.v1.routers import (
     auth, generics
 )
+from app.api import warmup
+from app.api.auth import password_executor
+from app.api.lib import metrics
+from app.api.lib.sentry import SentryMiddleware
 
 import app.config as config
+from app.db.registry import resources
+from app.db.session import on_engine
 import sentry_sdk
 
 tags_metadata = [
@@ -26,7 +32,11 @@ app = FastAPI(
     debug=config.ENVIRONMENT != 'production',
 )
 
-sentry_sdk.init(dsn=config.SENTRY_URL)
+sentry_sdk.init(
+    dsn=config.SENTRY_URL,
+    environment=config.ENVIRONMENT,
+    traces_sample_rate=config.SENTRY_TRACES_SAMPLE_RATE,
+)
 
 methods = ["GET", "POST", "DELETE", "PUT"]
 headers = [
@@ -52,17 +62,38 @@ app.add_middleware(
     allow_headers=headers,
 )
 
+# endpoint to route template, filled in once every router is included
+route_templates = {}
+slow_queries = metrics.SlowQueryLog(threshold=config.SLOW_QUERY_SECONDS)
+
+# always added, the slow query log & Server-Timing read its request stats. METRICS_ENABLED only decides
+# whether the prometheus series are collected
+app.add_middleware(
+    metrics.MetricsMiddleware,
+    routes=route_templates,
+    resources=resources,
+    server_timing=config.SERVER_TIMING,
+    collect=config.METRICS_ENABLED,
+)
+
+
+# outermost so it sees exceptions from every other middleware
+app.add_middleware(
+    SentryMiddleware,
+    traces_sample_rate=config.SENTRY_TRACES_SAMPLE_RATE,
+    routes=route_templates,
+)
+
 
-@app.middleware("http")
-async def sentry_exception(request: Request, call_next):
-    try:
-        response = await call_next(request)
-        return response
-    except Exception as e:
-        with sentry_sdk.push_scope() as scope:
-            scope.set_context("request", request)
-            sentry_sdk.capture_exception(e)
-        raise e
+@app.on_event("startup")
+async def warm_up():
+    # FastAPI 0.92 has no lifespan argument, startup handlers run before the first request is accepted
+    await warmup.warm_up(config.DB_WARM_CONNECTIONS)
+
+
+@app.on_event("shutdown")
+def shutdown_password_executor():
+    password_executor.shutdown()
 
 
 @app.get("/api/v1")
@@ -71,10 +102,25 @@ async def root():
     return {"message": "ok"}
 
 
+async def metrics_endpoint():
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+
 # Routers - add custom routers before generics
 app.include_router(auth.router, tags=["authentication"])
 app.include_router(generics.router, tags=["REST API"])
 
+if config.METRICS_ENABLED:
+    app.add_api_route("/metrics", metrics_endpoint, include_in_schema=False)
+
+# engines are created on first use, each is instrumented as it's created
+on_engine(
+    lambda name, db_engine: metrics.instrument_engine(db_engine, name, slow_queries, collect=config.METRICS_ENABLED)
+)
+
+# sentry names transactions by route template whether or not metrics are on
+route_templates.update({route.endpoint: route.path for route in app.routes if hasattr(route, "endpoint")})
+
 
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", reload=True, port=8888)
@@ -0,0 +1,120 @@
+"""
+Moves rows soft deleted more than `--days` ago out of every model's table into its archive table.
+
+    python manage.py archive_deleted --days 30 --batch-size 1000 --rate 5000
+
+Each batch locks its rows & moves them with one DELETE ... RETURNING feeding an INSERT in its own
+transaction, so the job can be stopped at any point & run again to carry on. `--rate` caps the rows moved per
+second so it can run alongside production traffic. Rows still pointed at by a foreign key stay until the rows
+pointing at them are archived, the referenced ids are read once per table rather than per batch. Rows a
+request had locked are skipped until the next run.
+
+`--dry_run` only counts, it doesn't create the archive tables
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import IntegrityError
+
+import app.db.models  # noqa: F401 - registers the models on Base
+from app.db.archive import (
+    archivable_tables,
+    archive_rows,
+    bump_version,
+    candidates,
+    count_eligible,
+    create_archive_table,
+    referenced_ids,
+)
+from app.db.session import Base, database
+
+# batches retried after a row they picked was referenced before giving up on the table
+MAX_CONFLICTS = 10
+
+
+def throttle(rows: int, elapsed: float, rate: float, pause: float):
+    """
+    Seconds to sleep after a batch of `rows` that took `elapsed` to stay under `rate` rows a second
+    """
+    wait = pause
+    if rate:
+        wait = max(wait, rows / rate - elapsed)
+    return wait
+
+
+def read_referenced(connection, table):
+    referenced = referenced_ids(table, Base.metadata)
+    return set(connection.execute(referenced).scalars()) if referenced is not None else set()
+
+
+def archive_table_rows(engine, table, cutoff, params, sleep=time.sleep):
+    with engine.begin() as connection:
+        eligible = connection.execute(count_eligible(table, Base.metadata, cutoff)).scalar()
+        print(f"{table.name}: {eligible} rows to archive")
+        if params.dry_run or not eligible:
+            return 0
+        create_archive_table(connection, table)
+        referenced = read_referenced(connection, table)
+
+    archived, after, batches, conflicts = 0, 0, 0, 0
+    start = time.perf_counter()
+    while params.max_batches is None or batches < params.max_batches:
+        batch_start = time.perf_counter()
+        try:
+            with engine.begin() as connection:
+                picked = connection.execute(candidates(table, cutoff, params.batch_size, after)).scalars().all()
+                ids = [i for i in picked if i not in referenced]
+                if ids:
+                    ids = connection.execute(archive_rows(table, ids)).scalars().all()
+                    # in the batch's transaction so no list etag sees the rows gone without the new version
+                    connection.execute(bump_version(table))
+        except IntegrityError:
+            # a row was referenced after the referenced ids were read, read them again & retry the batch
+            conflicts += 1
+            if conflicts > MAX_CONFLICTS:
+                raise
+            with engine.connect() as connection:
+                referenced = read_referenced(connection, table)
+            continue
+        batches += 1
+        if not picked:
+            break
+        archived += len(ids)
+        after = max(picked)
+        elapsed = time.perf_counter() - start
+        print(
+            f"{table.name}: archived {archived}/{eligible} ({archived / eligible:.0%}) "
+            f"up to id {after}, {archived / elapsed:.0f} rows/s"
+        )
+        if len(picked) < params.batch_size:
+            break
+        sleep(throttle(len(ids), time.perf_counter() - batch_start, params.rate, params.pause))
+    return archived
+
+
+def handle(*args):
+    parser = argparse.ArgumentParser(description="Moves soft deleted rows into archive tables")
+    parser.add_argument("--days", type=int, default=30, help="Archive rows deleted more than this many days ago")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Rows moved per transaction")
+    parser.add_argument("--rate", type=float, default=0, help="Max rows a second, 0 for no limit")
+    parser.add_argument("--pause", type=float, default=0.1, help="Seconds to wait between batches")
+    parser.add_argument("--max-batches", type=int, help="Stop after this many batches per table")
+    parser.add_argument("--tables", nargs="*", help="Only archive these tables")
+    parser.add_argument("--vacuum", action="store_true", help="VACUUM ANALYZE each table after archiving")
+    parser.add_argument("--dry_run", action="store_true", help="Only report how many rows would be archived")
+    params = parser.parse_args(*args)
+
+    engine = database().engine
+    cutoff = datetime.utcnow() - timedelta(days=params.days)
+    results = {}
+    for table in archivable_tables(Base.metadata):
+        if params.tables and table.name not in params.tables:
+            continue
+        results[table.name] = archive_table_rows(engine, table, cutoff, params)
+        if params.vacuum and results[table.name]:
+            # the space the moved rows took is only reused once vacuumed, VACUUM can't run in a transaction
+            with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+                connection.exec_driver_sql(f'VACUUM ANALYZE "{table.name}"')
+    print(f"archived {sum(results.values())} rows")
+    return results
@@ -0,0 +1,297 @@
+"""
+Benchmarks the api hot paths against a local postgres database.
+
+    python manage.py benchmark --database app_bench --rows 100000 --save results.json
+    python manage.py benchmark --database app_bench --baseline results.json
+
+Seeds `--rows` users owned by a benchmark user, then drives the app in process through httpx and,
+with `--served`, through uvicorn over http. Reports p50/p95/p99 latency, requests/sec and queries per
+request for each scenario. Queries are read from the Server-Timing header so SERVER_TIMING has to be on.
+The read scenarios repeat their urls, so the user & response caches are off unless `--caches` is passed,
+otherwise they'd be timing cache hits that run no queries
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import re
+import subprocess
+import threading
+import time
+
+BENCH_EMAIL = "benchmark@bench.test"
+# scenarios that are warmed up before they're timed, the others write
+READ_SCENARIOS = ("list_shallow", "list_deep_offset", "list_deep_cursor", "list_filter", "get")
+QUERIES = re.compile(r'db;[^,]*desc="(\d+) queries"')
+
+
+def percentile(values, p: float):
+    """
+    Nearest rank percentile of a list of values
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(p / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(latencies, queries, errors: int, elapsed: float) -> dict:
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2) if latencies else None,
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2) if latencies else None,
+        "queries_per_request": round(sum(queries) / len(queries), 2) if queries else None,
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float):
+    """
+    Returns the scenarios whose p95 got more than `tolerance` (a fraction) slower than the baseline
+    """
+    regressions = []
+    for mode, scenarios in results["results"].items():
+        for name, result in scenarios.items():
+            before = baseline.get("results", {}).get(mode, {}).get(name)
+            if not before or not before.get("p95_ms") or result.get("p95_ms") is None:
+                continue
+            change = result["p95_ms"] / before["p95_ms"] - 1
+            if change > tolerance:
+                regressions.append(f"{mode} {name}: p95 {before['p95_ms']}ms -> {result['p95_ms']}ms (+{change:.0%})")
+    return regressions
+
+
+def seed(rows: int, password_hash: str):
+    """
+    Creates the benchmark user and tops their records up to `rows`
+    """
+    from sqlalchemy import func, insert, select
+    from app.db.models import User
+    from app.db.session import Base, SessionManager, database
+
+    Base.metadata.create_all(database().engine)
+    with SessionManager() as db:
+        user = db.execute(select(User).where(User.email == BENCH_EMAIL)).scalar_one_or_none()
+        if user is None:
+            user = User(email=BENCH_EMAIL, password=password_hash, scopes="user", modified_by_id=None)
+            db.add(user)
+            db.commit()
+        user.password = password_hash
+        db.commit()
+        existing = db.execute(
+            select(func.count(User.id)).where(User.created_by_id == user.id, User.is_deleted == False)
+        ).scalar()
+        batch = []
+        for i in range(existing, rows):
+            batch.append(
+                {
+                    "email": f"bench-{i}-{random.getrandbits(32):x}@bench.test",
+                    "first_name": f"first {i}",
+                    "last_name": f"last {i % 1000}",
+                    "scopes": "user",
+                    "created_by_id": user.id,
+                    "modified_by_id": user.id,
+                }
+            )
+            if len(batch) == 5000:
+                db.execute(insert(User), batch)
+                batch = []
+        if batch:
+            db.execute(insert(User), batch)
+        db.commit()
+        db.connection().exec_driver_sql('ANALYZE "user"')
+        db.commit()
+        return user.email
+
+
+async def run_scenario(client, requests: int, concurrency: int, make_request):
+    latencies, queries = [], []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            response = await make_request(client, i)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                errors += 1
+            match = QUERIES.search(response.headers.get("server-timing", ""))
+            if match:
+                queries.append(int(match.group(1)))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    return summarize(latencies, queries, errors, time.perf_counter() - start)
+
+
+async def run_suite(client, params, email: str, password: str) -> dict:
+    from app.api.auth import create_access_token
+
+    token = create_access_token({"sub": email, "scopes": "user"})
+    headers = {"Authorization": f"Bearer {token}"}
+    limit = params.limit
+
+    first = (await client.get(f"/api/v1/user?limit={limit}&fields=id,external_id", headers=headers)).json()
+    ids = [r["external_id"] for r in first["data"]]
+    # walk to a deep page once so the cursor scenario seeks from there
+    deep_cursor = first.get("next_cursor")
+    deep_page = max(0, params.rows // limit - 1)
+    for _ in range(min(deep_page, params.cursor_depth)):
+        page = (await client.get(f"/api/v1/user?limit={limit}&after={deep_cursor}", headers=headers)).json()
+        ids += [r["external_id"] for r in page["data"]]
+        deep_cursor = page.get("next_cursor") or deep_cursor
+    created = []
+
+    async def create(client, i):
+        response = await client.post(
+            "/api/v1/user", headers=headers, json={"email": f"created-{random.getrandbits(64):x}@bench.test"}
+        )
+        if response.status_code < 400:
+            created.append(response.json()["external_id"])
+        return response
+
+    scenarios = {
+        "auth": lambda client, i: client.post(
+            "/api/v1/token", data={"username": email, "password": password}
+        ),
+        "list_shallow": lambda client, i: client.get(f"/api/v1/user?limit={limit}", headers=headers),
+        "list_deep_offset": lambda client, i: client.get(
+            f"/api/v1/user?limit={limit}&page={deep_page}", headers=headers
+        ),
+        "list_deep_cursor": lambda client, i: client.get(
+            f"/api/v1/user?limit={limit}&after={deep_cursor}", headers=headers
+        ),
+        "list_filter": lambda client, i: client.get(
+            f"/api/v1/user?limit={limit}&q=last_name = 'last {i % 1000}'", headers=headers
+        ),
+        "get": lambda client, i: client.get(f"/api/v1/user/{random.choice(ids)}", headers=headers),
+        "create": create,
+        "update": lambda client, i: client.put(
+            f"/api/v1/user/{random.choice(ids)}", headers=headers, json={"first_name": f"updated {i}"}
+        ),
+        "delete": lambda client, i: client.delete(f"/api/v1/user/{created[i % len(created)]}", headers=headers),
+    }
+    selected = params.scenarios or list(scenarios)
+    results = {}
+    for name in selected:
+        requests = params.auth_requests if name == "auth" else params.requests
+        if name == "delete":
+            # each created record is deleted once
+            requests = min(requests, len(created))
+            if not requests:
+                continue
+        if name in READ_SCENARIOS and params.warmup:
+            await run_scenario(client, params.warmup, params.concurrency, scenarios[name])
+        results[name] = await run_scenario(client, requests, params.concurrency, scenarios[name])
+        print(name, results[name])
+    return results
+
+
+async def in_process(params, email, password):
+    import httpx
+    from app.db.session import database
+    from app.main import app
+
+    try:
+        async with httpx.AsyncClient(app=app, base_url="http://bench") as client:
+            return await run_suite(client, params, email, password)
+    finally:
+        await database().async_engine.dispose()
+
+
+def served(params, email, password):
+    import httpx
+    import uvicorn
+    from app.main import app
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=params.port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+
+    async def run():
+        limits = httpx.Limits(max_connections=params.concurrency)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{params.port}", limits=limits) as client:
+            return await run_suite(client, params, email, password)
+
+    try:
+        return asyncio.run(run())
+    finally:
+        server.should_exit = True
+        thread.join()
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def handle(*args):
+    parser = argparse.ArgumentParser(description="Benchmarks the api hot paths")
+    parser.add_argument("--database", type=str, help="Database to seed & run against, defaults to POSTGRES_DB")
+    parser.add_argument("--rows", type=int, default=10000, help="Records owned by the benchmark user")
+    parser.add_argument("--requests", type=int, default=500, help="Requests per scenario")
+    parser.add_argument("--auth-requests", type=int, default=50, help="Requests for the auth scenario, bcrypt is slow")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=20, help="Untimed requests before each read scenario")
+    parser.add_argument("--limit", type=int, default=50, help="Page size for the list scenarios")
+    parser.add_argument("--cursor-depth", type=int, default=20, help="Pages to walk for the deep cursor")
+    parser.add_argument("--scenarios", nargs="*", help="Only run these scenarios")
+    parser.add_argument("--served", action="store_true", help="Also run against the app served by uvicorn")
+    parser.add_argument("--port", type=int, default=8899)
+    parser.add_argument("--save", type=str, help="Write the results to this json file")
+    parser.add_argument("--baseline", type=str, help="Compare against results saved with --save")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="p95 slowdown allowed against the baseline")
+    parser.add_argument("--caches", action="store_true", help="Keep the user & response caches on")
+    params = parser.parse_args(*args)
+
+    # the app connects to POSTGRES_DB when imported, so it has to be set first
+    if params.database:
+        os.environ["POSTGRES_DB"] = params.database
+    os.environ.pop("TEST_RUN", None)
+    os.environ.setdefault("SERVER_TIMING", "true")
+    if not params.caches:
+        os.environ["USER_CACHE_SIZE"] = "0"
+        os.environ["RESPONSE_CACHE_SIZE"] = "0"
+    from app.api.auth import get_password_hash
+
+    password = "benchmark-password"
+    email = seed(params.rows, get_password_hash(password))
+
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "rows": params.rows,
+            "requests": params.requests,
+            "concurrency": params.concurrency,
+            "limit": params.limit,
+            "caches": params.caches,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": {"in_process": asyncio.run(in_process(params, email, password))},
+    }
+    if params.served:
+        results["results"]["served"] = served(params, email, password)
+
+    if params.save:
+        with open(params.save, "w") as f:
+            json.dump(results, f, indent=2)
+    if params.baseline:
+        with open(params.baseline) as f:
+            regressions = compare(results, json.load(f), params.tolerance)
+        if regressions:
+            raise Exception("Performance regressions:\n" + "\n".join(regressions))
+        print("No regressions against the baseline")
+    return results
@@ -0,0 +1,33 @@
+import argparse
+from sqlalchemy import inspect
+from app.db.registry import resources
+from app.db.session import SessionManager, missing_indexes, standard_indexes
+
+
+def handle(*args):
+    parser = argparse.ArgumentParser(
+        description="Reports models missing the standard ownership / soft delete indexes"
+    )
+    parser.add_argument(
+        "--database",
+        action="store_true",
+        help="Also check the indexes exist in the database, e.g. after a migration",
+    )
+    params = parser.parse_args(*args)
+    missing = {meta.name: missing_indexes(meta.model.__table__) for meta in resources}
+    if params.database:
+        with SessionManager() as db:
+            inspector = inspect(db.get_bind())
+            for meta in resources:
+                existing = {index["name"] for index in inspector.get_indexes(meta.name)}
+                missing[meta.name] += [
+                    f"{index.name} (database)"
+                    for index in standard_indexes(meta.name)
+                    if index.name not in existing
+                ]
+    missing = {name: indexes for name, indexes in missing.items() if indexes}
+    for name, indexes in missing.items():
+        print(f"{name} is missing {', '.join(indexes)}")
+    if not missing:
+        print("All models have the standard indexes")
+    return missing
@@ -0,0 +1,68 @@
+"""
+Checks how long importing the app takes against a budget, so a slow import doesn't creep into cold starts.
+
+    python manage.py import_time --budget 500 --top 15
+
+Imports `--module` in a fresh interpreter under `python -X importtime`, prints the slowest modules by their
+own time & raises if the total is over `--budget` milliseconds. Takes the best of `--runs` runs to smooth
+out noise
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+LINE_PREFIX = "import time:"
+
+
+def parse_importtime(output: str):
+    """
+    (module, self µs, cumulative µs, depth) for each line of `-X importtime` output
+    """
+    modules = []
+    for line in output.splitlines():
+        if not line.startswith(LINE_PREFIX) or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len(LINE_PREFIX):].split("|")
+        # nested imports are indented by two spaces per level
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        modules.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return modules
+
+
+def total_ms(modules, module: str) -> float:
+    """
+    Time spent importing `module` & everything it imported, interpreter startup isn't counted
+    """
+    return sum(cumulative for name, _, cumulative, depth in modules if name == module and depth == 0) / 1000
+
+
+def measure(module: str):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        env=os.environ.copy(),
+    )
+    if result.returncode:
+        raise Exception(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+    return parse_importtime(result.stderr)
+
+
+def handle(*args):
+    parser = argparse.ArgumentParser(description="Checks the app's import time against a budget")
+    parser.add_argument("--module", type=str, default="app.main")
+    parser.add_argument("--budget", type=float, default=500, help="Milliseconds allowed for the import")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=15, help="Slowest modules to list")
+    params = parser.parse_args(*args)
+
+    runs = [measure(params.module) for _ in range(params.runs)]
+    modules = min(runs, key=lambda run: total_ms(run, params.module))
+    total = total_ms(modules, params.module)
+    for name, self_us, cumulative_us, _ in sorted(modules, key=lambda m: m[1], reverse=True)[:params.top]:
+        print(f"{self_us / 1000:8.1f}ms self {cumulative_us / 1000:8.1f}ms cumulative  {name}")
+    print(f"importing {params.module} took {total:.1f}ms, the budget is {params.budget:.0f}ms")
+    if total > params.budget:
+        raise Exception(f"Importing {params.module} took {total:.1f}ms, over the {params.budget:.0f}ms budget")
+    return total
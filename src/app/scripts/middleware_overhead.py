@@ -0,0 +1,121 @@
+"""
+Measures the per request overhead of the sentry middleware.
+
+    python manage.py middleware_overhead --requests 20000
+
+Drives a bare FastAPI app straight through ASGI, no sockets or database, with no middleware, with the old
+`@app.middleware("http")` wrapper & with `SentryMiddleware`. Reports the mean & p50/p99 per request and the
+overhead over the bare app, for a plain json response and a streamed one
+"""
+import argparse
+import asyncio
+import time
+
+import sentry_sdk
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from starlette.requests import Request
+
+from app.api.lib.sentry import SentryMiddleware
+from app.scripts.benchmark import percentile
+
+
+def http_middleware(app):
+    # the wrapper main.py used before SentryMiddleware
+    @app.middleware("http")
+    async def sentry_exception(request: Request, call_next):
+        try:
+            response = await call_next(request)
+            return response
+        except Exception as e:
+            with sentry_sdk.push_scope() as scope:
+                scope.set_context("request", request)
+                sentry_sdk.capture_exception(e)
+            raise e
+
+
+def asgi_middleware(app):
+    app.add_middleware(SentryMiddleware)
+
+
+def build_app(install=None):
+    app = FastAPI()
+
+    @app.get("/json")
+    async def json():
+        return {"message": "ok"}
+
+    @app.get("/stream")
+    async def stream():
+        async def chunks():
+            for _ in range(10):
+                yield b"x" * 1024
+
+        return StreamingResponse(chunks())
+
+    if install is not None:
+        install(app)
+    return app
+
+
+async def call(app, path: str):
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"host", b"bench")],
+        "client": ("127.0.0.1", 1234),
+        "server": ("bench", 80),
+    }
+    messages = [{"type": "http.request", "body": b"", "more_body": False}]
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        # the body has been read, wait as a client would until the response is done
+        await asyncio.sleep(3600)
+
+    async def send(message):
+        pass
+
+    await app(scope, receive, send)
+
+
+async def measure(app, path: str, requests: int, warmup: int):
+    for _ in range(warmup):
+        await call(app, path)
+    latencies = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        await call(app, path)
+        latencies.append(time.perf_counter() - start)
+    return {
+        "mean_us": round(sum(latencies) / len(latencies) * 1e6, 1),
+        "p50_us": round(percentile(latencies, 50) * 1e6, 1),
+        "p99_us": round(percentile(latencies, 99) * 1e6, 1),
+    }
+
+
+def handle(*args):
+    parser = argparse.ArgumentParser(description="Measures the per request overhead of the sentry middleware")
+    parser.add_argument("--requests", type=int, default=10000, help="Requests per variant")
+    parser.add_argument("--warmup", type=int, default=500)
+    params = parser.parse_args(*args)
+
+    variants = {"none": None, "http_middleware": http_middleware, "asgi": asgi_middleware}
+    results = {}
+    for path in ("/json", "/stream"):
+        results[path] = {}
+        for name, install in variants.items():
+            result = asyncio.run(measure(build_app(install), path, params.requests, params.warmup))
+            if name != "none":
+                result["overhead_us"] = round(result["mean_us"] - results[path]["none"]["mean_us"], 1)
+            results[path][name] = result
+            print(path, name, result)
+    return results
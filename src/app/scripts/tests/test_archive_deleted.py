@@ -0,0 +1,76 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from sqlalchemy import delete, inspect, insert, select
+
+from app.config import Scopes
+from app.db.archive import archive_table, archivable_tables, table_version
+from app.db.crud import list_version_query
+from app.db.models import User
+from app.db.session import Base, SessionManager, database
+from app.scripts.archive_deleted import handle, throttle
+
+
+def test_throttle():
+    assert throttle(1000, 0.1, rate=5000, pause=0) == 0.1
+    assert throttle(1000, 0.5, rate=5000, pause=0) == 0
+    assert throttle(1000, 0.5, rate=0, pause=0.2) == 0.2
+
+
+def test_archivable_tables_referencing_first():
+    names = [t.name for t in archivable_tables(Base.metadata)]
+    assert "user" in names
+    assert not any(name.startswith("archive_") for name in names)
+
+
+def test_archive_deleted(create_test_db):
+    old = datetime.utcnow() - timedelta(days=60)
+    rows = {
+        "archived": {"is_deleted": True, "modified": old},
+        "archived_too": {"is_deleted": True, "modified": old},
+        "referenced": {"is_deleted": True, "modified": old},
+        "recent": {"is_deleted": True, "modified": datetime.utcnow()},
+        "live": {"is_deleted": False, "modified": old},
+    }
+    with SessionManager() as db:
+        ids = {}
+        for name, values in rows.items():
+            ids[name] = db.execute(
+                insert(User).values(email=f"{name}@archive.test", modified_by_id=None, **values).returning(User.id)
+            ).scalar()
+        # a live record created by a deleted user keeps that user in place
+        db.execute(
+            insert(User).values(
+                email="child@archive.test", created_by_id=ids["referenced"], modified_by_id=ids["referenced"]
+            )
+        )
+        db.commit()
+
+    archive = archive_table(User.__table__)
+    try:
+        assert handle(["--days", "30", "--dry_run"])["user"] == 0
+        assert not inspect(database().engine).has_table(archive.name)
+        admin = SimpleNamespace(id=0, scopes=[Scopes.ADMIN, Scopes.USER])
+        with SessionManager() as db:
+            before = db.execute(list_version_query(User, admin)).one()
+        results = handle(["--days", "30", "--batch-size", "1", "--pause", "0", "--vacuum"])
+        assert results["user"] == 2
+        with SessionManager() as db:
+            remaining = set(db.execute(select(User.email).where(User.email.like("%@archive.test"))).scalars())
+            archived = db.execute(select(archive.c.email, archive.c.archived_at)).all()
+        assert remaining == {"referenced@archive.test", "recent@archive.test", "live@archive.test", "child@archive.test"}
+        assert sorted(email for email, _ in archived) == ["archived@archive.test", "archived_too@archive.test"]
+        assert all(archived_at is not None for _, archived_at in archived)
+        # the tombstones are gone, the archived version keeps the list etag from going back to an earlier one
+        with SessionManager() as db:
+            after = db.execute(list_version_query(User, admin)).one()
+        assert after[-1] == (before[-1] or 0) + 2
+        # nothing left to do, running again is a no-op
+        assert handle(["--days", "30", "--pause", "0"])["user"] == 0
+    finally:
+        with SessionManager() as db:
+            db.execute(delete(User).where(User.email == "child@archive.test"))
+            db.execute(delete(User).where(User.email.like("%@archive.test")))
+            db.execute(delete(table_version))
+            db.commit()
+        archive.drop(database().engine, checkfirst=True)
@@ -0,0 +1,30 @@
+from app.scripts.benchmark import compare, percentile, summarize
+
+
+def test_percentile():
+    values = [i / 1000 for i in range(1, 101)]
+    assert percentile(values, 50) == 0.05
+    assert percentile(values, 99) == 0.099
+    assert percentile([0.3], 95) == 0.3
+    assert percentile([], 50) is None
+
+
+def test_summarize():
+    result = summarize([0.01, 0.02, 0.03, 0.04], [3, 3, 2, 2], errors=1, elapsed=2)
+    assert result == {
+        "requests": 4,
+        "errors": 1,
+        "rps": 2.0,
+        "p50_ms": 20.0,
+        "p95_ms": 40.0,
+        "p99_ms": 40.0,
+        "queries_per_request": 2.5,
+    }
+
+
+def test_compare_against_baseline():
+    baseline = {"results": {"in_process": {"get": {"p95_ms": 10.0}, "list_shallow": {"p95_ms": 20.0}}}}
+    results = {"results": {"in_process": {"get": {"p95_ms": 13.0}, "list_shallow": {"p95_ms": 21.0}, "new": {"p95_ms": 5}}}}
+    regressions = compare(results, baseline, tolerance=0.2)
+    assert len(regressions) == 1
+    assert regressions[0].startswith("in_process get")
@@ -0,0 +1,24 @@
+from app.scripts.import_time import parse_importtime, total_ms
+
+OUTPUT = """import time: self [us] | cumulative | imported package
+import time:       120 |        120 |   _io
+import time:       300 |        900 | encodings
+import time:        50 |         50 |     app.config
+import time:      2000 |       2050 |   app.db
+import time:      1000 |       3050 | app.main
+some other stderr line
+"""
+
+
+def test_parse_importtime():
+    modules = parse_importtime(OUTPUT)
+    assert modules[0] == ("_io", 120, 120, 1)
+    assert modules[2] == ("app.config", 50, 50, 2)
+    assert modules[-1] == ("app.main", 1000, 3050, 0)
+    assert len(modules) == 5
+
+
+def test_total_counts_the_module_only():
+    modules = parse_importtime(OUTPUT)
+    assert total_ms(modules, "app.main") == 3.05
+    assert total_ms(modules, "app.db") == 0
@@ -0,0 +1,93 @@
+import pytest
+from sqlalchemy import delete, insert, select, update
+
+from app.db import batch
+from app.db.models import User
+from app.db.session import SessionManager
+
+EMAILS = "%@batch.test"
+
+
+def mark_chunk(db, start, stop):
+    result = db.execute(
+        update(User)
+        .where(User.id >= start, User.id < stop, User.email.like(EMAILS))
+        .values(last_name="backfilled")
+    )
+    return result.rowcount
+
+
+def fail_chunk(db, start, stop):
+    raise ValueError("chunk failed")
+
+
+def seed(count):
+    with SessionManager() as db:
+        db.execute(insert(User), [{"email": f"{i}@batch.test", "modified_by_id": None} for i in range(count)])
+        db.commit()
+        return batch.id_ranges(db, User, 7, User.email.like(EMAILS))
+
+
+def cleanup():
+    with SessionManager() as db:
+        db.execute(delete(User).where(User.email.like(EMAILS)))
+        db.commit()
+
+
+def test_id_ranges_and_iterate(create_test_db):
+    try:
+        chunks = seed(20)
+        assert len(chunks) == 3
+        assert chunks[0][1] == chunks[1][0] and chunks[-1][1] - chunks[0][0] == 20
+        with SessionManager() as db:
+            batches = list(batch.iterate(db, select(User).where(User.email.like(EMAILS)), 6, scalars=True))
+            assert batch.id_ranges(db, User, 7, User.email == "nobody") == []
+        assert [len(users) for users in batches] == [6, 6, 6, 2]
+        assert all(isinstance(user, User) for user in batches[0])
+    finally:
+        cleanup()
+
+
+def test_run_chunks_in_workers_with_checkpoint(create_test_db, tmp_path):
+    checkpoint_path = str(tmp_path / "checkpoint.json")
+    messages = []
+    try:
+        chunks = seed(20)
+        checkpoint = batch.Checkpoint(checkpoint_path)
+        checkpoint.mark(chunks[0])
+        results = batch.run_chunks(mark_chunk, chunks, workers=2, checkpoint=batch.Checkpoint(checkpoint_path))
+        # the chunk already in the checkpoint is skipped
+        assert set(results) == set(chunks[1:])
+        assert sum(results.values()) == 13
+        with SessionManager() as db:
+            backfilled = db.execute(
+                select(User.id).where(User.email.like(EMAILS), User.last_name == "backfilled")
+            ).scalars().all()
+        assert len(backfilled) == 13 and min(backfilled) >= chunks[1][0]
+
+        # ranges computed again after rows changed are ignored, the planned ones are resumed
+        shifted = [(start + 3, stop + 3) for start, stop in chunks]
+        resumed = batch.run_chunks(
+            mark_chunk, shifted, checkpoint=batch.Checkpoint(checkpoint_path), progress=messages.append
+        )
+        assert resumed == {}
+        assert batch.Checkpoint(checkpoint_path).chunks == chunks
+        assert messages == ["resuming, 3 of 3 chunks already done"]
+    finally:
+        cleanup()
+
+
+def test_run_chunks_failure(create_test_db):
+    try:
+        chunks = seed(10)
+        with pytest.raises(ValueError, match="chunk failed"):
+            batch.run_chunks(fail_chunk, chunks, workers=2, progress=lambda message: None)
+    finally:
+        cleanup()
+
+
+def test_worker_count(monkeypatch):
+    monkeypatch.setattr(batch, "BATCH_WORKERS", 3)
+    assert batch.worker_count() == 3
+    assert batch.worker_count(2) == 2
+    assert batch.worker_count(0) >= 1
@@ -0,0 +1,42 @@
+from app.api import auth
+from app.api.lib.cache import TTLCache
+
+
+class FakeTimer:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def test_ttl_cache_expires():
+    timer = FakeTimer()
+    cache = TTLCache(maxsize=10, ttl=5, timer=timer)
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+    timer.now = 6
+    assert cache.get("a") is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_user_cache_invalidated_on_write(client, superuser_token_headers, test_superuser):
+    auth.user_cache.clear()
+    client.get("/api/v1/user", headers=superuser_token_headers)
+    assert auth.user_cache.get(test_superuser.email) is not None
+
+    data = {"first_name": "cached"}
+    client.put(f"/api/v1/user/{test_superuser.external_id}", headers=superuser_token_headers, json=data)
+    assert auth.user_cache.get(test_superuser.email) is None
@@ -0,0 +1,24 @@
+import asyncio
+import threading
+import pytest
+from fastapi import HTTPException
+
+from app.api.lib.executors import BoundedExecutor
+
+
+def test_bounded_executor_rejects_when_full():
+    executor = BoundedExecutor(kind="thread", max_workers=1, max_pending=1)
+    release = threading.Event()
+
+    async def run():
+        blocked = asyncio.ensure_future(executor.run(release.wait))
+        await asyncio.sleep(0)
+        with pytest.raises(HTTPException) as e:
+            await executor.run(sum, [1, 2])
+        release.set()
+        await blocked
+        assert e.value.status_code == 503
+        assert await executor.run(sum, [1, 2]) == 3
+
+    asyncio.run(run())
+    executor.shutdown()
@@ -0,0 +1,61 @@
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from app.api.lib.filters import FilterError, compile_filter, compile_shape, parse_filter
+from app.db.registry import resources
+
+
+def compiled(q):
+    expression = compile_filter(resources.get("user"), q)
+    return expression.compile(dialect=postgresql.dialect())
+
+
+def test_filter_compiles_to_bound_parameters():
+    sql = compiled("email = 'a@b.com' and (first_name startswith 'Jo' or id in (1, 2))")
+    assert "'a@b.com'" not in str(sql)
+    assert list(sql.params.values()) == ["a@b.com", "Jo%", [1, 2]]
+
+
+def test_filter_shape_ignores_values():
+    first_shape, first_values = parse_filter("id between 1 and 5 and email = 'a'")
+    second_shape, second_values = parse_filter("id between 10 and 50 and email = 'b'")
+    assert first_shape == second_shape
+    assert first_values != second_values
+
+    meta = resources.get("user")
+    compile_shape.cache_clear()
+    compile_filter(meta, "id between 1 and 5 and email = 'a'")
+    compile_filter(meta, "id between 10 and 50 and email = 'b'")
+    assert compile_shape.cache_info().hits == 1
+
+
+@pytest.mark.parametrize("q", [
+    "password = 'x'",
+    "notacolumn = 1",
+    "id = 'abc'",
+    "id =",
+    "email = 'a' and",
+    "(id = 1",
+    "created > 5",
+    "id startswith 1",
+    "is_disabled startswith 't'",
+    "(" * 2000 + "id = 1" + ")" * 2000,
+    "not " * 2000 + "id = 1",
+    "id in (" + ", ".join(["1"] * 2000) + ")",
+])
+def test_invalid_filters(q):
+    with pytest.raises(FilterError):
+        compile_filter(resources.get("user"), q)
+
+
+def test_filter_indexed_only():
+    meta = resources.get("user")
+    meta.filter_indexed_only = True
+    try:
+        compile_shape.cache_clear()
+        compile_filter(meta, "email = 'a'")
+        with pytest.raises(FilterError):
+            compile_filter(meta, "first_name = 'a'")
+    finally:
+        meta.filter_indexed_only = False
+        compile_shape.cache_clear()
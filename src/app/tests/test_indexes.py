@@ -0,0 +1,46 @@
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import Column, Index, Integer, MetaData, Table, text
+from sqlalchemy.dialects import postgresql
+
+from app.config import Scopes
+from app.db.crud import list_version_query
+from app.db.models import User
+from app.db.registry import resources
+from app.db.session import SessionManager, missing_indexes
+from app.scripts.check_indexes import handle
+
+
+def test_models_have_standard_indexes():
+    assert handle([]) == {}
+
+
+def test_database_has_standard_indexes(client):
+    assert handle(["--database"]) == {}
+
+
+def test_missing_indexes_reported():
+    table = Table("widget", MetaData(), Column("id", Integer), Column("modified", Integer))
+    Index("ix_widget_modified", table.c.modified)
+    assert missing_indexes(table) == ["ix_widget_owner_live", "ux_widget_external_id_live", "ix_widget_owner_modified"]
+
+
+def test_owner_scope_is_indexed():
+    meta = resources.get("user")
+    assert {"created_by_id", "external_id", "modified"} <= meta.indexed_columns
+
+
+@pytest.mark.parametrize(
+    "scopes, index", [([Scopes.USER], "ix_user_owner_modified"), ([Scopes.ADMIN, Scopes.USER], "ix_user_modified")]
+)
+def test_list_etag_probe_is_indexed(create_test_db, scopes, index):
+    # the probe runs on every list request, it has to stay an index lookup however many rows there are
+    statement = list_version_query(User, SimpleNamespace(id=1, scopes=scopes))
+    sql = statement.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True})
+    with SessionManager() as db:
+        # the test tables are tiny, a seq scan would win without this
+        db.execute(text("SET enable_seqscan = off"))
+        plan = "\n".join(db.execute(text(f"EXPLAIN {sql}")).scalars())
+    assert index in plan
+    assert "Seq Scan" not in plan
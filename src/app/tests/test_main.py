@@ -1,4 +1,12 @@
+from app.main import root, route_templates
+
+
 def test_read_main(client):
     response = client.get("/api/v1")
     assert response.status_code == 200
-    assert response.json() == {"message": "ok"}
\ No newline at end of file
+    assert response.json() == {"message": "ok"}
+
+
+def test_route_templates_filled():
+    # sentry needs them even when metrics are off
+    assert route_templates[root] == "/api/v1"
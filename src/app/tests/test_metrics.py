@@ -0,0 +1,99 @@
+import logging
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, text
+
+from app.api.lib.metrics import (
+    Counter,
+    Gauge,
+    Histogram,
+    MetricsMiddleware,
+    Registry,
+    SlowQueryLog,
+    instrument_engine,
+    normalize_statement,
+    queries_total,
+    requests_total,
+)
+
+
+def test_render_prometheus_format():
+    registry = Registry()
+    counter = registry.register(Counter("hits_total", "Hits", ("route",)))
+    gauge = registry.register(Gauge("in_flight", "In flight", collect=lambda: {(): 3}))
+    histogram = registry.register(Histogram("latency_seconds", "Latency", ("route",), buckets=(0.1, 1.0)))
+    counter.inc('/a/{id}')
+    counter.inc('/a/{id}')
+    histogram.observe(0.05, "/a")
+    histogram.observe(0.1, "/a")
+    histogram.observe(3, "/a")
+    lines = registry.render().splitlines()
+    assert "# TYPE hits_total counter" in lines
+    assert 'hits_total{route="/a/{id}"} 2' in lines
+    assert "in_flight 3" in lines
+    assert 'latency_seconds_bucket{route="/a",le="0.1"} 2' in lines
+    assert 'latency_seconds_bucket{route="/a",le="1.0"} 2' in lines
+    assert 'latency_seconds_bucket{route="/a",le="+Inf"} 3' in lines
+    assert 'latency_seconds_count{route="/a"} 3' in lines
+    assert gauge.values == {(): 3}
+
+
+def test_metrics_endpoint(client, superuser_token_headers):
+    client.get("/api/v1/user/not-a-record", headers=superuser_token_headers)
+    client.get("/api/v1/nothing", headers=superuser_token_headers)
+    text = client.get("/metrics").text
+    assert (
+        'http_requests_total{method="GET",route="/api/v1/{resource}/{recordid}",resource="user",status="404"}'
+        in text
+    )
+    assert 'resource="unknown"' in text
+    assert 'http_request_duration_seconds_count{method="GET",route="/api/v1/{resource}/{recordid}",resource="user"}' in text
+    assert 'db_queries_per_request_count{route="/api/v1/{resource}/{recordid}"}' in text
+    assert "db_pool_checkouts_total" in text
+
+
+def test_normalize_statement():
+    first = normalize_statement("SELECT *\n  FROM t WHERE id IN ($1, $2, $3) AND x = $4::VARCHAR")
+    second = normalize_statement("SELECT * FROM t WHERE id IN ($1, $2) AND x = $3::VARCHAR")
+    assert first == second == "SELECT * FROM t WHERE id IN (?, ...) AND x = ?::VARCHAR"
+
+
+def test_slow_query_log_aggregates_shapes(caplog):
+    log = SlowQueryLog(threshold=0.1)
+    log.record("SELECT 1 WHERE a = $1", ("secret",), "/r", 0.05)
+    assert log.shapes == {}
+    with caplog.at_level(logging.WARNING, logger="metrics"):
+        log.record("SELECT 1 WHERE a = $1", ("secret",), "/r", 0.2)
+        log.record("SELECT 1   WHERE a = $1", ("other",), "/r", 0.3)
+    assert log.top() == [("SELECT 1 WHERE a = ?", {"count": 2, "total": 0.5, "max": 0.3})]
+    assert "secret" not in caplog.text
+    assert "params=['str']" in caplog.text
+    assert "seen 2 times" in caplog.text
+
+
+def test_server_timing_header(client, superuser_token_headers):
+    response = client.get("/api/v1/user", headers=superuser_token_headers)
+    timing = response.headers["server-timing"]
+    assert timing.startswith("db;dur=")
+    for name in ("auth;dur=", "serialize;dur=", "total;dur="):
+        assert name in timing
+
+
+def test_timing_and_slow_queries_without_metrics():
+    engine = create_engine("sqlite://")
+    slow_queries = SlowQueryLog(threshold=0)
+    instrument_engine(engine, "no_metrics", slow_queries, collect=False)
+    app = FastAPI()
+
+    @app.get("/query")
+    def query():
+        with engine.connect() as connection:
+            return connection.execute(text("SELECT 1")).scalar()
+
+    app.add_middleware(MetricsMiddleware, routes={query: "/query"}, server_timing=True, collect=False)
+    response = TestClient(app).get("/query")
+    assert 'desc="1 queries"' in response.headers["server-timing"]
+    assert [shape for shape, _ in slow_queries.top()] == ["SELECT 1"]
+    assert not any("/query" in labels for labels in requests_total.values)
+    assert ("no_metrics",) not in queries_total.values
@@ -0,0 +1,62 @@
+import asyncio
+
+from sqlalchemy import select
+from sqlalchemy.pool import NullPool
+
+from app.config import ASYNC_TEST_DB_CONNECTION_STR, TEST_DB_CONNECTION_STR
+from app.db.models import User
+from app.db.session import Database, pool_options
+
+
+def test_defaults():
+    options, async_options = pool_options()
+    assert options == async_options
+    assert options["pool_size"] == 32
+    assert options["max_overflow"] == 64
+
+
+def test_budget_split_between_workers():
+    options, _ = pool_options(budget=100, workers=4)
+    assert (options["pool_size"], options["max_overflow"]) == (25, 0)
+    options, _ = pool_options(budget=100, workers=4, max_overflow=5)
+    assert (options["pool_size"], options["max_overflow"]) == (20, 5)
+    # every worker gets a connection even when the budget is smaller than the workers
+    options, _ = pool_options(budget=2, workers=8)
+    assert options["pool_size"] == 1
+
+
+def test_explicit_sizes_win():
+    options, _ = pool_options(pool_size=5, max_overflow=2, budget=100, workers=4, timeout=3, recycle=600)
+    assert options == {
+        "pool_pre_ping": True,
+        "pool_size": 5,
+        "max_overflow": 2,
+        "pool_timeout": 3,
+        "pool_recycle": 600,
+    }
+
+
+def test_transaction_pooler_mode():
+    options, async_options = pool_options(pool_size=0, pooler_mode="transaction")
+    assert options == {"poolclass": NullPool}
+    assert async_options["connect_args"] == {"statement_cache_size": 0, "prepared_statement_cache_size": 0}
+    options, async_options = pool_options(pool_size=4, pooler_mode="transaction")
+    assert options["pool_size"] == async_options["pool_size"] == 4
+    assert "connect_args" not in options
+
+
+def test_transaction_pooler_mode_queries(create_test_db):
+    _, async_options = pool_options(pool_size=2, pooler_mode="transaction")
+    target = Database("pooler", TEST_DB_CONNECTION_STR, ASYNC_TEST_DB_CONNECTION_STR, {}, async_options)
+
+    async def run():
+        try:
+            for _ in range(3):
+                async with target.async_session() as db:
+                    await db.execute(select(User).where(User.email == "nobody"))
+                    raw = (await db.connection()).sync_connection.connection.dbapi_connection
+                    assert raw._prepared_statement_cache is None
+        finally:
+            await target.async_engine.dispose()
+
+    asyncio.run(run())
@@ -0,0 +1,72 @@
+from app.db import crud
+from app.db.models import User
+from app.db.session import ReplicaSet, read_keys
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeReplica:
+    def __init__(self, url):
+        self.url = url
+
+
+def replica_set(count=2):
+    clock = Clock()
+    replicas = ReplicaSet(
+        [FakeReplica(f"replica{i}") for i in range(count)],
+        retry_seconds=30,
+        consistency_seconds=5,
+        timer=clock,
+    )
+    return replicas, clock
+
+
+def test_no_replicas_reads_primary():
+    replicas = ReplicaSet([], retry_seconds=30, consistency_seconds=5)
+    assert replicas.choose(*read_keys(user_id=1)) is None
+
+
+def test_round_robin():
+    replicas, _ = replica_set(2)
+    urls = [replicas.choose().url for _ in range(4)]
+    assert urls == ["replica0", "replica1", "replica0", "replica1"]
+
+
+def test_unhealthy_replica_skipped_until_retry():
+    replicas, clock = replica_set(2)
+    down = replicas.replicas[0]
+    replicas.mark_down(down)
+    assert {replicas.choose().url for _ in range(4)} == {"replica1"}
+    replicas.mark_down(replicas.replicas[1])
+    assert replicas.choose() is None
+    clock.now = 31
+    assert {replicas.choose().url for _ in range(4)} == {"replica0", "replica1"}
+
+
+def test_read_your_writes():
+    replicas, clock = replica_set(1)
+    replicas.mark_written(*read_keys(user_id=1), *read_keys(model=User))
+    assert replicas.choose(*read_keys(user_id=1)) is None
+    assert replicas.choose(*read_keys(model=User)) is None
+    assert replicas.choose(*read_keys(user_id=2)) is not None
+    clock.now = 6
+    assert replicas.choose(*read_keys(user_id=1)) is not None
+
+
+def test_writes_tracked_by_listener():
+    replicas, _ = replica_set(1)
+    original = crud.replicas
+    crud.replicas = replicas
+    try:
+        crud.notify_write(User, [{"id": 3, "modified_by_id": 7}])
+    finally:
+        crud.replicas = original
+    assert replicas.choose(*read_keys(user_id=7)) is None
+    assert replicas.choose(*read_keys(model=User)) is None
+    assert replicas.choose(*read_keys(user_id=8)) is not None
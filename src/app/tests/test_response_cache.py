@@ -0,0 +1,70 @@
+import asyncio
+
+from app.api.lib.response_cache import LocalBackend, ResponseCache
+
+
+class SharedBackend:
+    """
+    Stands in for redis, one instance is shared by caches that would be in different processes
+    """
+
+    def __init__(self):
+        self.values = {}
+
+    async def get(self, key):
+        return self.values.get(key)
+
+    async def set(self, key, value):
+        self.values[key] = value
+
+    async def generations(self, names):
+        return [self.values.get(f"generation:{name}", 0) for name in names]
+
+    def bump(self, name):
+        self.values[f"generation:{name}"] = self.values.get(f"generation:{name}", 0) + 1
+
+
+def test_generation_invalidates():
+    async def run():
+        cache = ResponseCache(LocalBackend(maxsize=10, ttl=60), max_bytes=100)
+        key = await cache.key(["user"], "admin", "list", "limit=10")
+        await cache.set(key, b"[]", 'W/"a"')
+        assert await cache.get(key) == (b"[]", 'W/"a"')
+        cache.invalidate("user")
+        assert len(cache.backend.entries) == 0
+        assert await cache.key(["user"], "admin", "list", "limit=10") != key
+
+    asyncio.run(run())
+
+
+def test_keys_by_scope_and_related_resources():
+    async def run():
+        cache = ResponseCache(LocalBackend(maxsize=10, ttl=60), max_bytes=100)
+        assert await cache.key(["user"], "admin", "list") != await cache.key(["user"], "user:1", "list")
+        key = await cache.key(["post", "user"], "admin", "list")
+        cache.invalidate("user")
+        assert await cache.key(["post", "user"], "admin", "list") != key
+
+    asyncio.run(run())
+
+
+def test_large_bodies_not_cached():
+    async def run():
+        cache = ResponseCache(LocalBackend(maxsize=10, ttl=60), max_bytes=4)
+        await cache.set("user:key", b"12345", 'W/"a"')
+        assert await cache.get("user:key") is None
+
+    asyncio.run(run())
+
+
+def test_shared_backend_invalidates_every_process():
+    async def run():
+        shared = SharedBackend()
+        first, second = ResponseCache(shared, max_bytes=100), ResponseCache(shared, max_bytes=100)
+        key = await first.key(["user"], "admin", "get", "abc")
+        await first.set(key, b"{}", 'W/"a"')
+        assert await second.get(await second.key(["user"], "admin", "get", "abc")) == (b"{}", 'W/"a"')
+        second.invalidate("user")
+        assert await first.get(await first.key(["user"], "admin", "get", "abc")) is None
+
+    asyncio.run(run())
@@ -0,0 +1,84 @@
+import asyncio
+
+import pytest
+import sentry_sdk
+import sentry_sdk.transport
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+
+from app.api.lib.sentry import SentryMiddleware
+
+
+class Transport(sentry_sdk.transport.Transport):
+    def __init__(self, options=None):
+        super().__init__(options)
+        self.events = []
+
+    def capture_event(self, event):
+        self.events.append(event)
+
+    def capture_envelope(self, envelope):
+        self.events += [item.payload.json for item in envelope.items if item.payload.json]
+
+
+def build_app(routes=None, **kwargs):
+    app = FastAPI()
+
+    @app.get("/boom/{item}")
+    async def boom(item: str):
+        raise ValueError("boom")
+
+    @app.get("/stream")
+    async def stream():
+        async def chunks():
+            for i in range(3):
+                yield f"chunk {i}\n".encode()
+                await asyncio.sleep(0)
+
+        return StreamingResponse(chunks(), media_type="text/plain")
+
+    app.add_middleware(SentryMiddleware, routes=routes, **kwargs)
+    return app, boom
+
+
+def test_exception_captured_and_reraised():
+    events = []
+    routes = {}
+    app, boom = build_app(routes)
+    routes[boom] = "/boom/{item}"
+    with sentry_sdk.Hub(sentry_sdk.Client(dsn="http://key@localhost/1", transport=events.append)):
+        with pytest.raises(ValueError):
+            TestClient(app).get("/boom/1?secret=no")
+    assert len(events) == 1
+    event = events[0]
+    assert event["exception"]["values"][0]["type"] == "ValueError"
+    assert event["contexts"]["request"] == {
+        "method": "GET",
+        "path": "/boom/1",
+        "route": "/boom/{item}",
+        "query_string": "secret=no",
+    }
+
+
+def test_stream_passed_through():
+    events = []
+    app, _ = build_app()
+    with sentry_sdk.Hub(sentry_sdk.Client(dsn="http://key@localhost/1", transport=events.append)):
+        response = TestClient(app).get("/stream")
+    assert response.status_code == 200
+    assert response.text == "chunk 0\nchunk 1\nchunk 2\n"
+    assert events == []
+
+
+def test_sampled_transaction_named_by_route():
+    transport = Transport()
+    routes = {}
+    app, boom = build_app(routes, traces_sample_rate=1.0)
+    routes[boom] = "/boom/{item}"
+    client = sentry_sdk.Client(dsn="http://key@localhost/1", transport=transport, traces_sample_rate=1.0)
+    with sentry_sdk.Hub(client):
+        with pytest.raises(ValueError):
+            TestClient(app).get("/boom/1")
+    transactions = [e for e in transport.events if e.get("type") == "transaction"]
+    assert [t["transaction"] for t in transactions] == ["/boom/{item}"]
@@ -0,0 +1,61 @@
+import asyncio
+from types import SimpleNamespace
+
+from sqlalchemy import event
+from sqlalchemy.engine.default import CACHE_MISS
+from sqlalchemy.pool import NullPool
+
+from app.api.utils import common_params, resolve_params
+from app.api.warmup import hot_statements, warm_database
+from app.config import ASYNC_TEST_DB_CONNECTION_STR, TEST_DB_CONNECTION_STR, Scopes
+from app.db.crud import ListQuery
+from app.db.models import User
+from app.db.registry import resources
+from app.db.session import Database, databases, database
+
+
+def test_engines_created_for_this_environment_only(client, superuser_token_headers):
+    client.get("/api/v1/user", headers=superuser_token_headers)
+    assert database() is databases["test"]
+    assert "async_engine" in databases["test"].__dict__
+    assert "engine" not in databases["primary"].__dict__
+    assert "async_engine" not in databases["primary"].__dict__
+
+
+def test_warm_database_compiles_and_pools(create_test_db):
+    target = Database("warm", TEST_DB_CONNECTION_STR, ASYNC_TEST_DB_CONNECTION_STR, {}, {"pool_size": 2})
+    compiled = []
+
+    @event.listens_for(target.async_engine.sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        compiled.append(context.cache_hit is CACHE_MISS)
+
+    async def run():
+        try:
+            statements = await hot_statements()
+            assert await warm_database(target, 5, statements) == 2
+            assert target.async_engine.pool.checkedin() == 2
+            compiled.clear()
+            db = target.async_session()
+            for statement in statements:
+                await db.execute(statement)
+            # a real admin's list runs the shape the warmup admin compiled
+            admin = SimpleNamespace(id=1, scopes=[Scopes.ADMIN, Scopes.USER])
+            meta = resources.for_model(User)
+            await db.execute(ListQuery(User, resolve_params(meta, await common_params()), admin).page)
+            await db.close()
+        finally:
+            await target.async_engine.dispose()
+
+    asyncio.run(run())
+    # nothing compiled again after warming
+    assert compiled and not any(compiled)
+
+
+def test_warm_database_without_pool(create_test_db):
+    target = Database("warm_null", TEST_DB_CONNECTION_STR, ASYNC_TEST_DB_CONNECTION_STR, {}, {"poolclass": NullPool})
+
+    async def run():
+        return await warm_database(target, 5, await hot_statements())
+
+    assert asyncio.run(run()) == 1
@@ -10,6 +10,7 @@ sentry_sdk.init(dsn=os.environ.get("SENTRY_URL"))
 
 # usage: from the backend dir, run python manage.py ${file_name}
 # if your script is in a subdir, reference the subdir in the file path. e.g. python manage.py migrations/example
+# --workers N sets how many processes scripts using app.db.batch spread over, 0 for every core
 
 if __name__ == "__main__":
     scripts = []
@@ -19,6 +20,17 @@ if __name__ == "__main__":
                 scripts.append(os.path.join(dirpath, filename).replace(f"{working_dir}/", ''))
     func = f"{sys.argv[1]}"
     inputs = sys.argv[2:]
+    if "--workers" in inputs:
+        # processes for app.db.batch, read from the environment so it has to be set before the script is imported
+        index = inputs.index("--workers")
+        try:
+            workers = int(inputs[index + 1])
+        except (IndexError, ValueError):
+            workers = -1
+        if workers < 0:
+            sys.exit("usage: python manage.py <script> --workers N, N is a number of processes, 0 for every core")
+        os.environ["BATCH_WORKERS"] = str(workers)
+        inputs = inputs[:index] + inputs[index + 2:]
     if f"{func}.py" in scripts:
         try:
             module = import_module(f"app.scripts.{func.replace('/', '.')}")